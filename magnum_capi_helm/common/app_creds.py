@@ -16,7 +16,9 @@
 # This code is making use of the good work done here:
 # https://github.com/vexxhost/magnum-cluster-api/blob/main/magnum_cluster_api/resources.py
 
-import yaml
+import functools
+import json
+import pathlib
 
 import certifi
 import keystoneauth1
@@ -26,9 +28,35 @@ from magnum.common import clients
 from magnum.common import utils
 import magnum.conf
 
+from magnum_capi_helm import driver_utils
+
 CONF = magnum.conf.CONF
 LOG = logging.getLogger(__name__)
 
+# The clouds.yaml document always has the same shape, so we render it
+# from a template rather than running the full YAML emitter every time
+_CLOUDS_YAML_TEMPLATE = """\
+clouds:
+  openstack:
+    auth:
+      application_credential_id: {application_credential_id}
+      application_credential_secret: {application_credential_secret}
+      auth_url: {auth_url}
+    auth_type: v3applicationcredential
+    identity_api_version: 3
+    interface: {interface}
+    region_name: {region_name}
+    verify: {verify}
+"""
+
+# Validating the configured region lists the keystone regions, and the
+# identity endpoint comes from the project's service catalog. Neither
+# changes often, so we keep them for a few minutes, for a bounded number
+# of regions and projects, rather than asking keystone for every cluster
+_CLOUD_LOCATION_CACHE_SECONDS = 300
+_CLOUD_LOCATION_CACHE_SIZE = 64
+_CLOUD_LOCATION_CACHE = {}
+
 
 def _get_openstack_ca_certificate():
     # This function returns the CA bundle to use when verifying TLS
@@ -40,11 +68,45 @@ def _get_openstack_ca_certificate():
     # This is because the Cluster API provider contains NO trusted CAs
     # and, because it is a pod in Kubernetes, it does NOT pick up the
     # trusted CAs from the host
-    ca_certificate = utils.get_openstack_ca()
-    if not ca_certificate:
-        with open(certifi.where(), "r") as ca_file:
-            ca_certificate = ca_file.read()
-    return ca_certificate
+    return utils.get_openstack_ca() or _get_certifi_ca_bundle()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_certifi_ca_bundle():
+    # The certifi bundle only changes when the package is upgraded, which
+    # requires a restart, so we only read it the first time it is needed
+    return pathlib.Path(certifi.where()).read_bytes().decode("utf-8")
+
+
+def _get_cloud_location(key, lookup):
+    value = driver_utils.get_cached(_CLOUD_LOCATION_CACHE, key)
+    if value is None:
+        value = lookup()
+        driver_utils.set_cached(
+            _CLOUD_LOCATION_CACHE,
+            key,
+            value,
+            _CLOUD_LOCATION_CACHE_SECONDS,
+            max_size=_CLOUD_LOCATION_CACHE_SIZE,
+        )
+    return value
+
+
+def _get_region_name(osc):
+    return _get_cloud_location(
+        ("region", CONF.cinder_client.region_name), osc.cinder_region_name
+    )
+
+
+def _get_identity_url(context, osc):
+    return _get_cloud_location(
+        ("identity", context.project_id),
+        lambda: osc.url_for(service_type="identity", interface="public"),
+    )
+
+
+def _get_app_cred_name(cluster):
+    return f"magnum-{cluster.uuid}"
 
 
 def _create_app_cred(context, cluster):
@@ -53,7 +115,7 @@ def _create_app_cred(context, cluster):
     # roles = [role for role in context.roles if role != "admin"]
     app_cred = osc.keystone().client.application_credentials.create(
         user=cluster.user_id,
-        name=f"magnum-{cluster.uuid}",
+        name=_get_app_cred_name(cluster),
         description=f"Magnum cluster ({cluster.uuid})",
         # roles=roles,
     )
@@ -61,15 +123,13 @@ def _create_app_cred(context, cluster):
         "clouds": {
             "openstack": {
                 "identity_api_version": 3,
-                "region_name": osc.cinder_region_name(),
+                "region_name": _get_region_name(osc),
                 "interface": CONF.capi_helm.app_cred_interface_type,
                 # This config item indicates whether TLS should be
                 # verified when connecting to the OpenStack API
                 "verify": CONF.drivers.verify_ca,
                 "auth": {
-                    "auth_url": osc.url_for(
-                        service_type="identity", interface="public"
-                    ),
+                    "auth_url": _get_identity_url(context, osc),
                     "application_credential_id": app_cred.id,
                     "application_credential_secret": app_cred.secret,
                 },
@@ -79,9 +139,53 @@ def _create_app_cred(context, cluster):
     }
 
 
+def _yaml_scalar(value):
+    # Any JSON scalar is also a valid YAML flow scalar, and json.dumps
+    # takes care of quoting and escaping any special characters
+    return json.dumps(value)
+
+
+@functools.lru_cache(maxsize=16)
+def _get_clouds_yaml_template(region_name, interface, verify, auth_url):
+    # Only the credential itself differs between clusters, so render
+    # everything else once and leave placeholders for the credential
+
+    def _preformatted(value):
+        # Escape braces so they survive the second call to format
+        return _yaml_scalar(value).replace("{", "{{").replace("}", "}}")
+
+    return _CLOUDS_YAML_TEMPLATE.format(
+        application_credential_id="{application_credential_id}",
+        application_credential_secret="{application_credential_secret}",
+        auth_url=_preformatted(auth_url),
+        interface=_preformatted(interface),
+        region_name=_preformatted(region_name),
+        verify=_preformatted(verify),
+    )
+
+
+def _render_clouds_yaml(app_cred_dict):
+    cloud = app_cred_dict["clouds"]["openstack"]
+    auth = cloud["auth"]
+    template = _get_clouds_yaml_template(
+        cloud["region_name"],
+        cloud["interface"],
+        cloud["verify"],
+        auth["auth_url"],
+    )
+    return template.format(
+        application_credential_id=_yaml_scalar(
+            auth["application_credential_id"]
+        ),
+        application_credential_secret=_yaml_scalar(
+            auth["application_credential_secret"]
+        ),
+    )
+
+
 def get_app_cred_string_data(context, cluster):
     app_cred_dict = _create_app_cred(context, cluster)
-    clouds_yaml_str = yaml.safe_dump(app_cred_dict)
+    clouds_yaml_str = _render_clouds_yaml(app_cred_dict)
     return {
         "cacert": _get_openstack_ca_certificate(),
         "clouds.yaml": clouds_yaml_str,
@@ -90,15 +194,16 @@ def get_app_cred_string_data(context, cluster):
 
 def delete_app_cred(context, cluster):
     osc = clients.OpenStackClients(context)
+    name = _get_app_cred_name(cluster)
     try:
         appcred = osc.keystone().client.application_credentials.find(
-            name=f"magnum-{cluster.uuid}", user=cluster.user_id
+            name=name, user=cluster.user_id
         )
     except keystoneauth1.exceptions.http.NotFound:
         # We don't want this to be a failure condition as it may prevent
         # cleanup of broken clusters, e.g. if cluster creation fails
         # before the appcred is created or cluster deletion fails after
         # the appcred is deleted
-        LOG.warning("Appcred does not exist for %s", cluster.uuid)
+        LOG.warning("Appcred %s does not exist for %s", name, cluster.uuid)
     else:
         appcred.delete()
@@ -122,6 +122,18 @@ capi_helm_opts = [
         default="nova",
         help=("The default availability zone to use for Cinder volumes."),
     ),
+    cfg.IntOpt(
+        "max_parallel_requests",
+        default=32,
+        min=1,
+        help=(
+            "Maximum number of threads, shared by all clusters, used to "
+            "make independent Kubernetes and OpenStack API requests in "
+            "parallel. Requests wait for a free thread once this is "
+            "reached, so it should allow for the number of clusters "
+            "being created, updated or deleted at the same time."
+        ),
+    ),
     cfg.StrOpt(
         "app_cred_interface_type",
         default="public",
@@ -9,7 +9,9 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+from concurrent import futures
 import enum
+import functools
 import re
 
 from magnum.api import utils as api_utils
@@ -35,6 +37,83 @@ LOG = logging.getLogger(__name__)
 CONF = conf.CONF
 NODE_GROUP_ROLE_CONTROLLER = "master"
 
+# Patterns used to filter untrusted user input
+_LABEL_FILTER = re.compile(r"[^a-zA-Z0-9\.\-\/ _]+")
+_CHART_VERSION_FILTER = re.compile(r"[^a-z0-9\.\-\+]+")
+_KUBE_VERSION_FILTER = re.compile(r"[^0-9\.]+")
+_OS_DISTRO_FILTER = re.compile(r"[^a-zA-Z0-9\.\-\/ ]+")
+
+_CIDR_SEPARATOR = re.compile(r"\s*,\s*")
+
+# Conditions that must all be true before we consider the
+# control plane or the cluster as a whole to be ready
+_KCP_READY_CONDITIONS = frozenset(
+    (
+        "MachinesReady",
+        "Ready",
+        "EtcdClusterHealthy",
+        "ControlPlaneComponentsHealthy",
+    )
+)
+_CLUSTER_READY_CONDITIONS = frozenset(
+    ("InfrastructureReady", "ControlPlaneReady", "Ready")
+)
+
+# Flavors rarely change, so we keep the list from Nova for a short time
+# rather than fetching it again for every flavor we validate
+_FLAVOR_CACHE_SECONDS = 60
+_FLAVOR_CACHE = {}
+
+# Likewise for the Cinder volume types we turn into storage classes
+_VOLUME_TYPE_CACHE_SECONDS = 60
+_VOLUME_TYPE_CACHE = {}
+
+# The operation each status belongs to, e.g. CREATE for CREATE_COMPLETE,
+# so we can look it up rather than checking each prefix in turn
+_STATUS_OPERATIONS = {
+    status: status.split("_", 1)[0] for status in fields.ClusterStatus.ALL
+}
+_IN_PROGRESS_STATUSES = frozenset(
+    status
+    for status in fields.ClusterStatus.ALL
+    if status.endswith("_IN_PROGRESS")
+)
+_CREATING_OR_UPDATING = frozenset(
+    (
+        fields.ClusterStatus.CREATE_IN_PROGRESS,
+        fields.ClusterStatus.UPDATE_IN_PROGRESS,
+    )
+)
+
+# Marks a resource that has not been fetched yet, as None means not found
+_NOT_FETCHED = object()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_executor():
+    # Shared between operations, so we don't start new threads, and load
+    # new Kubernetes clients for them, every time we make independent
+    # requests at the same time
+    # Created on first use, once the config has been loaded
+    return futures.ThreadPoolExecutor(
+        max_workers=CONF.capi_helm.max_parallel_requests
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_cidrs(cidr_list):
+    # Clusters tend to share a handful of CIDR lists,
+    # so each distinct list is only split once
+    return tuple(
+        cidr for cidr in _CIDR_SEPARATOR.split(cidr_list.strip()) if cidr
+    )
+
+
+def _merge_labels(template_labels, cluster_labels):
+    # Labels are a flat mapping of strings, so unlike helm values
+    # they don't need a deep merge
+    return {**(template_labels or {}), **(cluster_labels or {})}
+
 
 class NodeGroupState(enum.Enum):
     NOT_PRESENT = 1
@@ -46,13 +125,12 @@ class NodeGroupState(enum.Enum):
 class Driver(driver.Driver):
     def __init__(self):
         self._helm_client = helm.Client()
-        self.__k8s_client = None
 
     @property
     def _k8s_client(self):
-        if not self.__k8s_client:
-            self.__k8s_client = kubernetes.Client.load()
-        return self.__k8s_client
+        # Clients are cached per thread, so this is cheap, and the
+        # lookups run on the executor each use their own session
+        return kubernetes.Client.load()
 
     @property
     def provides(self):
@@ -71,14 +149,20 @@ class Driver(driver.Driver):
             },
         ]
 
-    def _update_control_plane_nodegroup_status(self, cluster, nodegroup):
-        # The status of the master nodegroup is determined by the Cluster API
-        # control plane object
-        kcp = self._k8s_client.get_kubeadm_control_plane(
+    def _get_kubeadm_control_plane(self, cluster):
+        return self._k8s_client.get_kubeadm_control_plane(
             driver_utils.get_k8s_resource_name(cluster, "control-plane"),
             driver_utils.cluster_namespace(cluster),
         )
 
+    def _update_control_plane_nodegroup_status(
+        self, cluster, nodegroup, kcp=_NOT_FETCHED
+    ):
+        # The status of the master nodegroup is determined by the Cluster API
+        # control plane object
+        if kcp is _NOT_FETCHED:
+            kcp = self._get_kubeadm_control_plane(cluster)
+
         ng_state = NodeGroupState.NOT_PRESENT
         if kcp:
             ng_state = NodeGroupState.PENDING
@@ -91,22 +175,13 @@ class Driver(driver.Driver):
         kube_version = kcp_status.get("version", kcp_spec.get("version"))
         if cluster.coe_version != kube_version:
             cluster.coe_version = kube_version
-            cluster.save()
 
         kcp_true_conditions = {
             cond["type"]
             for cond in kcp_status.get("conditions", [])
             if cond["status"] == "True"
         }
-        kcp_ready = all(
-            cond in kcp_true_conditions
-            for cond in (
-                "MachinesReady",
-                "Ready",
-                "EtcdClusterHealthy",
-                "ControlPlaneComponentsHealthy",
-            )
-        )
+        kcp_ready = _KCP_READY_CONDITIONS.issubset(kcp_true_conditions)
         target_replicas = kcp_spec.get("replicas")
         current_replicas = kcp_status.get("replicas")
         updated_replicas = kcp_status.get("updatedReplicas")
@@ -122,13 +197,18 @@ class Driver(driver.Driver):
         # TODO(mkjpryor) Work out a way to determine FAILED state
         return self._update_nodegroup_status(cluster, nodegroup, ng_state)
 
-    def _update_worker_nodegroup_status(self, cluster, nodegroup):
+    def _update_worker_nodegroup_status(
+        self, cluster, nodegroup, machine_deployments=None
+    ):
         # The status of a worker nodegroup is determined by the corresponding
         # Cluster API machine deployment
-        md = self._k8s_client.get_machine_deployment(
-            driver_utils.get_k8s_resource_name(cluster, nodegroup.name),
-            driver_utils.cluster_namespace(cluster),
-        )
+        md_name = driver_utils.get_k8s_resource_name(cluster, nodegroup.name)
+        if machine_deployments is None:
+            md = self._k8s_client.get_machine_deployment(
+                md_name, driver_utils.cluster_namespace(cluster)
+            )
+        else:
+            md = machine_deployments.get(md_name)
 
         ng_state = NodeGroupState.NOT_PRESENT
         if md:
@@ -141,13 +221,14 @@ class Driver(driver.Driver):
         # until all the machines for the node group are gone
         if (
             not md
-            and nodegroup.status.startswith("DELETE_")
+            and _STATUS_OPERATIONS.get(nodegroup.status) == "DELETE"
             and self._nodegroup_machines_exist(cluster, nodegroup)
         ):
             LOG.debug(
-                f"Node group {nodegroup.name} "
-                f"for cluster {cluster.uuid} "
-                "machine deployment gone, but machines still found."
+                "Node group %s for cluster %s "
+                "machine deployment gone, but machines still found.",
+                nodegroup.name,
+                cluster.uuid,
             )
             ng_state = NodeGroupState.PENDING
 
@@ -162,8 +243,9 @@ class Driver(driver.Driver):
         return self._update_nodegroup_status(cluster, nodegroup, ng_state)
 
     def _update_nodegroup_status(self, cluster, nodegroup, ng_state):
+        operation = _STATUS_OPERATIONS.get(nodegroup.status)
         # For delete we are waiting for not present
-        if nodegroup.status.startswith("DELETE_"):
+        if operation == "DELETE":
             if ng_state == NodeGroupState.NOT_PRESENT:
                 if not nodegroup.is_default:
                     # Conductor will delete default nodegroups
@@ -171,25 +253,29 @@ class Driver(driver.Driver):
                     # node groups should be deleted here.
                     nodegroup.destroy()
                 LOG.debug(
-                    f"Node group deleted: {nodegroup.name} "
-                    f"for cluster {cluster.uuid} "
-                    f"which is_default: {nodegroup.is_default}"
+                    "Node group deleted: %s for cluster %s "
+                    "which is_default: %s",
+                    nodegroup.name,
+                    cluster.uuid,
+                    nodegroup.is_default,
                 )
                 # signal the node group has been deleted
                 return None
 
             LOG.debug(
-                f"Node group not yet delete: {nodegroup.name} "
-                f"for cluster {cluster.uuid}"
+                "Node group not yet delete: %s for cluster %s",
+                nodegroup.name,
+                cluster.uuid,
             )
             return nodegroup
 
-        is_update_operation = nodegroup.status.startswith("UPDATE_")
-        is_create_operation = nodegroup.status.startswith("CREATE_")
-        if not is_update_operation and not is_create_operation:
+        is_update_operation = operation == "UPDATE"
+        if not is_update_operation and operation != "CREATE":
             LOG.warning(
-                f"Node group: {nodegroup.name} in unexpected "
-                f"state: {nodegroup.status} in cluster {cluster.uuid}"
+                "Node group: %s in unexpected state: %s in cluster %s",
+                nodegroup.name,
+                nodegroup.status,
+                cluster.uuid,
             )
         elif ng_state == NodeGroupState.READY:
             nodegroup.status = (
@@ -198,8 +284,9 @@ class Driver(driver.Driver):
                 else fields.ClusterStatus.CREATE_COMPLETE
             )
             LOG.debug(
-                f"Node group ready: {nodegroup.name} "
-                f"in cluster {cluster.uuid}"
+                "Node group ready: %s in cluster %s",
+                nodegroup.name,
+                cluster.uuid,
             )
             nodegroup.save()
 
@@ -210,19 +297,24 @@ class Driver(driver.Driver):
                 else fields.ClusterStatus.CREATE_FAILED
             )
             LOG.debug(
-                f"Node group failed: {nodegroup.name} "
-                f"in cluster {cluster.uuid}"
+                "Node group failed: %s in cluster %s",
+                nodegroup.name,
+                cluster.uuid,
             )
             nodegroup.save()
         elif ng_state == NodeGroupState.NOT_PRESENT:
             LOG.debug(
-                f"Node group not yet found: {nodegroup.name} "
-                f"state:{nodegroup.status} in cluster {cluster.uuid}"
+                "Node group not yet found: %s state:%s in cluster %s",
+                nodegroup.name,
+                nodegroup.status,
+                cluster.uuid,
             )
         else:
             LOG.debug(
-                f"Node group still pending: {nodegroup.name} "
-                f"state:{nodegroup.status} in cluster {cluster.uuid}"
+                "Node group still pending: %s state:%s in cluster %s",
+                nodegroup.name,
+                nodegroup.status,
+                cluster.uuid,
             )
 
         return nodegroup
@@ -231,12 +323,17 @@ class Driver(driver.Driver):
         cluster_name = driver_utils.chart_release_name(cluster)
         nodegroup_name = driver_utils.sanitized_name(nodegroup.name)
         machines = self._k8s_client.get_all_machines_by_label(
-            {
-                "capi.stackhpc.com/cluster": cluster_name,
-                "capi.stackhpc.com/component": "worker",
-                "capi.stackhpc.com/node-group": nodegroup_name,
-            },
+            # The selector is built directly, as there is no need
+            # to build a dict that the client would then join
+            (
+                f"capi.stackhpc.com/cluster={cluster_name},"
+                "capi.stackhpc.com/component=worker,"
+                f"capi.stackhpc.com/node-group={nodegroup_name}"
+            ),
             driver_utils.cluster_namespace(cluster),
+            # We only need to know if there are any
+            limit=1,
+            metadata_only=True,
         )
         return bool(machines)
 
@@ -249,10 +346,7 @@ class Driver(driver.Driver):
             # skip update if cluster not yet created
             return
 
-        if cluster.status not in [
-            fields.ClusterStatus.CREATE_IN_PROGRESS,
-            fields.ClusterStatus.UPDATE_IN_PROGRESS,
-        ]:
+        if cluster.status not in _CREATING_OR_UPDATING:
             # only update api-address when updating or creating
             return
 
@@ -263,8 +357,7 @@ class Driver(driver.Driver):
             )
             if cluster.api_address != api_address:
                 cluster.api_address = api_address
-                cluster.save()
-                LOG.debug(f"Found api_address for {cluster.uuid}")
+                LOG.debug("Found api_address for %s", cluster.uuid)
 
     def _update_status_updating(self, cluster, capi_cluster):
         # If the cluster is not yet ready then the create/update
@@ -274,14 +367,15 @@ class Driver(driver.Driver):
             for cond in capi_cluster.get("status", {}).get("conditions", [])
             if cond["status"] == "True"
         }
-        for cond in ("InfrastructureReady", "ControlPlaneReady", "Ready"):
-            if cond not in true_conditions:
-                return
+        if not _CLUSTER_READY_CONDITIONS.issubset(true_conditions):
+            return
 
-        is_update_operation = cluster.status.startswith("UPDATE_")
+        is_update_operation = (
+            _STATUS_OPERATIONS.get(cluster.status) == "UPDATE"
+        )
 
         # Check the status of the addons
-        addons = self._k8s_client.get_addons_by_label(
+        addons = self._k8s_client.iter_addons_by_label(
             {
                 "addons.stackhpc.com/cluster": driver_utils.chart_release_name(
                     cluster
@@ -298,7 +392,6 @@ class Driver(driver.Driver):
                     if is_update_operation
                     else fields.ClusterStatus.CREATE_FAILED
                 )
-                cluster.save()
                 return
             elif addon_phase and addon_phase == "Deployed":
                 # If the addon is deployed, move on to the next one
@@ -307,8 +400,9 @@ class Driver(driver.Driver):
                 # If there are any addons that are not deployed or failed,
                 # wait for the next invocation to check again
                 LOG.debug(
-                    f"addon {addon['metadata']['name']} not yet deployed "
-                    f"for {cluster.uuid}"
+                    "addon %s not yet deployed for %s",
+                    addon["metadata"]["name"],
+                    cluster.uuid,
                 )
                 return
 
@@ -318,7 +412,6 @@ class Driver(driver.Driver):
             if is_update_operation
             else fields.ClusterStatus.CREATE_COMPLETE
         )
-        cluster.save()
 
     def _update_status_deleting(self, context, cluster):
         # Once the Cluster API cluster is gone, we need to clean up
@@ -333,7 +426,6 @@ class Driver(driver.Driver):
         app_creds.delete_app_cred(context, cluster)
 
         cluster.status = fields.ClusterStatus.DELETE_COMPLETE
-        cluster.save()
 
     def _get_capi_cluster(self, cluster):
         release_name = driver_utils.chart_release_name(cluster)
@@ -343,30 +435,87 @@ class Driver(driver.Driver):
                 driver_utils.cluster_namespace(cluster),
             )
 
+    def _get_machine_deployments(self, cluster):
+        """Returns the cluster's machine deployments, keyed by name."""
+        machine_deployments = (
+            self._k8s_client.get_machine_deployments_by_label(
+                {
+                    "cluster.x-k8s.io/cluster-name": (
+                        driver_utils.chart_release_name(cluster)
+                    ),
+                },
+                driver_utils.cluster_namespace(cluster),
+            )
+        )
+        return {md["metadata"]["name"]: md for md in machine_deployments}
+
+    def _get_nodegroup_resources(self, cluster, nodegroups):
+        """Returns the control plane and machine deployments for a cluster.
+
+        The two reads are independent, so they are made at the same time.
+        All the machine deployments are fetched in one request, rather than
+        making a request for each worker node group.
+        """
+        roles = {ng.role for ng in nodegroups}
+        fetch_kcp = NODE_GROUP_ROLE_CONTROLLER in roles
+        fetch_mds = bool(roles - {NODE_GROUP_ROLE_CONTROLLER})
+        if not (fetch_kcp and fetch_mds):
+            kcp = (
+                self._get_kubeadm_control_plane(cluster)
+                if fetch_kcp
+                else _NOT_FETCHED
+            )
+            mds = self._get_machine_deployments(cluster) if fetch_mds else {}
+            return kcp, mds
+
+        # Only one read goes to the shared pool, the other is made on this
+        # thread in the meantime
+        mds = _get_executor().submit(self._get_machine_deployments, cluster)
+        try:
+            kcp = self._get_kubeadm_control_plane(cluster)
+        except Exception:
+            mds.cancel()
+            raise
+        return kcp, mds.result()
+
     def _update_all_nodegroups_status(self, cluster):
         """Returns True if any node group still in progress."""
-        nodegroups = []
-        for nodegroup in cluster.nodegroups:
+        in_progress = False
+        nodegroups = cluster.nodegroups
+        kcp, machine_deployments = self._get_nodegroup_resources(
+            cluster, nodegroups
+        )
+        for nodegroup in nodegroups:
             if nodegroup.role == NODE_GROUP_ROLE_CONTROLLER:
                 updated_nodegroup = (
                     self._update_control_plane_nodegroup_status(
-                        cluster, nodegroup
+                        cluster, nodegroup, kcp
                     )
                 )
             else:
                 updated_nodegroup = self._update_worker_nodegroup_status(
-                    cluster, nodegroup
+                    cluster, nodegroup, machine_deployments
                 )
-            if updated_nodegroup:
-                nodegroups.append(updated_nodegroup)
+            # Every node group must be updated, so keep going
+            # even once we know one is still in progress
+            if (
+                updated_nodegroup
+                and updated_nodegroup.status in _IN_PROGRESS_STATUSES
+            ):
+                in_progress = True
 
-        # Return True if any are still in progress
-        for nodegroup in nodegroups:
-            if nodegroup.status.endswith("_IN_PROGRESS"):
-                return True
-        return False
+        return in_progress
 
     def update_cluster_status(self, context, cluster):
+        try:
+            self._reconcile_cluster_status(context, cluster)
+        finally:
+            # The reconcile only changes the cluster in memory,
+            # so write all of the changes to the database at once
+            if cluster.obj_what_changed():
+                cluster.save()
+
+    def _reconcile_cluster_status(self, context, cluster):
         # NOTE(mkjpryor)
         # Because Kubernetes operators are built around reconciliation loops,
         # Cluster API clusters don't really go into an error state
@@ -388,18 +537,15 @@ class Driver(driver.Driver):
                 cluster
             )
 
-        if cluster.status in {
-            fields.ClusterStatus.CREATE_IN_PROGRESS,
-            fields.ClusterStatus.UPDATE_IN_PROGRESS,
-        }:
+        if cluster.status in _CREATING_OR_UPDATING:
             LOG.debug("Checking on an update for %s", cluster.uuid)
             # If the cluster does not exist yet,
             # create is still in progress
             if not capi_cluster:
-                LOG.debug(f"capi_cluster not yet created for {cluster.uuid}")
+                LOG.debug("capi_cluster not yet created for %s", cluster.uuid)
                 return
             if nodegroups_in_progress:
-                LOG.debug(f"Node groups are not all ready for {cluster.uuid}")
+                LOG.debug("Node groups are not all ready for %s", cluster.uuid)
                 return
             self._update_status_updating(cluster, capi_cluster)
 
@@ -408,7 +554,7 @@ class Driver(driver.Driver):
             # If the Cluster API cluster still exists,
             # the delete is still in progress
             if capi_cluster:
-                LOG.debug(f"capi_cluster still found for {cluster.uuid}")
+                LOG.debug("capi_cluster still found for %s", cluster.uuid)
                 return
             self._update_status_deleting(context, cluster)
 
@@ -447,31 +593,43 @@ class Driver(driver.Driver):
         # Cluster API looks for specific named secrets for each of the CAs,
         # and generates them if they don't exist, so we create them here
         # with the correct certificates in
-        for (
-            name,
-            data,
-        ) in ca_certificates.get_certificate_string_data(
-            context, cluster
-        ).items():
+        # The labels and namespace are the same for every secret
+        labels = self._k8s_resource_labels(cluster)
+        namespace = driver_utils.cluster_namespace(cluster)
+
+        def apply_secret(item):
+            name, data = item
             self._k8s_client.apply_secret(
                 driver_utils.get_k8s_resource_name(cluster, name),
                 {
-                    "metadata": {"labels": self._k8s_resource_labels(cluster)},
+                    "metadata": {"labels": labels},
                     "type": "cluster.x-k8s.io/secret",
                     "stringData": data,
                 },
-                driver_utils.cluster_namespace(cluster),
+                namespace,
             )
 
+        # The secrets are independent, so apply them all at the same time
+        # Consuming the results waits for them all, and raises the first
+        # error that occurred
+        list(
+            _get_executor().map(
+                apply_secret,
+                ca_certificates.get_certificate_string_data(
+                    context, cluster
+                ).items(),
+            )
+        )
+
     def _label(self, cluster, key, default):
-        all_labels = helm.mergeconcat(
+        all_labels = _merge_labels(
             cluster.cluster_template.labels, cluster.labels
         )
         if not all_labels:
             return default
         raw = all_labels.get(key, default)
         # NOTE(johngarbutt): filtering untrusted user input
-        return re.sub(r"[^a-zA-Z0-9\.\-\/ _]+", "", raw)
+        return _LABEL_FILTER.sub("", raw)
 
     def _get_label_bool(self, cluster, label, default):
         cluster_label = self._label(cluster, label, "")
@@ -492,7 +650,7 @@ class Driver(driver.Driver):
             CONF.capi_helm.default_helm_chart_version,
         )
         # NOTE(johngarbutt): filtering untrusted user input
-        return re.sub(r"[^a-z0-9\.\-\+]+", "", version)
+        return _CHART_VERSION_FILTER.sub("", version)
 
     def _get_kube_version(self, image):
         # The image should have a property containing the Kubernetes version
@@ -504,7 +662,7 @@ class Driver(driver.Driver):
             )
         raw = kube_version.lstrip("v")
         # TODO(johngarbutt) more validation required?
-        return re.sub(r"[^0-9\.]+", "", raw)
+        return _KUBE_VERSION_FILTER.sub("", raw)
 
     def _get_os_distro(self, image):
         os_distro = image.get("os_distro")
@@ -513,7 +671,7 @@ class Driver(driver.Driver):
                 message=f"Image {image.id} does not "
                 "have an os_distro property."
             )
-        return re.sub(r"[^a-zA-Z0-9\.\-\/ ]+", "", os_distro)
+        return _OS_DISTRO_FILTER.sub("", os_distro)
 
     def _get_image_details(self, context, image_identifier):
         osc = clients.OpenStackClients(context)
@@ -568,7 +726,9 @@ class Driver(driver.Driver):
     def _get_dns_nameservers(self, cluster):
         dns_nameserver = cluster.cluster_template.dns_nameserver
         if dns_nameserver:
-            return strutils.split_by_commas(dns_nameserver)
+            # A plain list of addresses, so there is no quoting to handle
+            nameservers = [ns.strip() for ns in dns_nameserver.split(",")]
+            return [ns for ns in nameservers if ns]
         else:
             return None
 
@@ -588,12 +748,12 @@ class Driver(driver.Driver):
         return self._get_label_bool(cluster, "auto_scaling_enabled", False)
 
     def _get_autoscale_values(self, cluster, nodegroup):
-        auto_scale = self._get_autoscale_enabled(cluster)
+        # Only called once the caller knows autoscaling is enabled
         min_nodes, max_nodes = self._validate_allowed_node_counts(
             cluster, nodegroup
         )
         auto_scale_args = {}
-        if auto_scale and min_nodes != max_nodes:
+        if min_nodes != max_nodes:
             auto_scale_args["autoscale"] = "true"
             auto_scale_args["machineCountMin"] = min_nodes
             auto_scale_args["machineCountMax"] = max_nodes
@@ -602,8 +762,7 @@ class Driver(driver.Driver):
     def _get_k8s_keystone_auth_enabled(self, cluster):
         return self._get_label_bool(cluster, "keystone_auth_enabled", False)
 
-    def _get_fixed_network_id(self, context, cluster):
-        network = cluster.fixed_network
+    def _get_fixed_network_id(self, context, network):
         if not network:
             return
         if network and uuidutils.is_uuid_like(network):
@@ -613,33 +772,46 @@ class Driver(driver.Driver):
                 context, network, source="name", target="id", external=False
             )
 
-    def _validate_allowed_flavor(self, context, requested_flavor):
-        # Compare requested flavor with allowed for Kubernetes node
-        flavors = (
+    def _get_flavor_vcpus(self, context):
+        """Returns vcpus of flavors with enough RAM, by id and name."""
+        min_ram = CONF.capi_helm.minimum_flavor_ram
+        cache_key = (context.project_id, min_ram)
+        flavor_vcpus = driver_utils.get_cached(_FLAVOR_CACHE, cache_key)
+        if flavor_vcpus is not None:
+            return flavor_vcpus
+
+        # Only keep the vcpus, rather than the flavor resources, which
+        # hold on to the client and session built for this context
+        flavor_vcpus = {}
+        for flavor in (
             clients.OpenStackClients(context)
             .nova()
-            .flavors.list(min_ram=CONF.capi_helm.minimum_flavor_ram)
+            .flavors.list(min_ram=min_ram)
+        ):
+            flavor_vcpus.setdefault(flavor.id, flavor.vcpus)
+            flavor_vcpus.setdefault(flavor.name, flavor.vcpus)
+        driver_utils.set_cached(
+            _FLAVOR_CACHE, cache_key, flavor_vcpus, _FLAVOR_CACHE_SECONDS
         )
-        for flavor in flavors:
-            vcpus = flavor.vcpus
-            LOG.debug(
-                f"Checking if {requested_flavor} matches "
-                f"{flavor.id} or {flavor.name}"
+        return flavor_vcpus
+
+    def _validate_allowed_flavor(self, context, requested_flavor):
+        # Compare requested flavor with allowed for Kubernetes node
+        LOG.debug("Checking flavor %s is allowed", requested_flavor)
+        vcpus = self._get_flavor_vcpus(context).get(requested_flavor)
+        if vcpus is None:
+            raise exception.MagnumException(
+                message=f"Flavor {requested_flavor} does not "
+                f"have enough RAM to run Kubernetes. "
+                f"Minimum {CONF.capi_helm.minimum_flavor_ram} MB required."
+            )
+        if vcpus < CONF.capi_helm.minimum_flavor_vcpus:
+            raise exception.MagnumException(
+                message=f"Flavor {requested_flavor} does not "
+                f"have enough CPU to run Kubernetes. "
+                f"Minimum {CONF.capi_helm.minimum_flavor_vcpus} "
+                "vcpus required."
             )
-            if requested_flavor in [flavor.id, flavor.name]:
-                if vcpus < CONF.capi_helm.minimum_flavor_vcpus:
-                    raise exception.MagnumException(
-                        message=f"Flavor {requested_flavor} does not "
-                        f"have enough CPU to run Kubernetes. "
-                        f"Minimum {CONF.capi_helm.minimum_flavor_vcpus} "
-                        "vcpus required."
-                    )
-                return
-        raise exception.MagnumException(
-            message=f"Flavor {requested_flavor} does not "
-            f"have enough RAM to run Kubernetes. "
-            f"Minimum {CONF.capi_helm.minimum_flavor_ram} MB required."
-        )
 
     def _is_default_worker_nodegroup(self, cluster, nodegroup):
         return cluster.default_ng_worker.id == nodegroup.id
@@ -751,21 +923,36 @@ class Driver(driver.Driver):
 
     def _get_allowed_cidrs(self, cluster):
         cidr_list = cluster.labels.get("api_master_lb_allowed_cidrs", "")
-        LOG.debug(f"CIDR list {cidr_list}")
+        LOG.debug("CIDR list %s", cidr_list)
         if isinstance(cidr_list, str) and cidr_list != "":
-            return cidr_list.split(",")
+            return list(_parse_cidrs(cidr_list)) or False
         return False
 
+    def _get_volume_type_names(self, context):
+        volume_types = driver_utils.get_cached(
+            _VOLUME_TYPE_CACHE, context.project_id
+        )
+        if volume_types is not None:
+            return volume_types
+
+        LOG.debug("Retrieve volume types from cinder for StorageClasses.")
+        c_client = clients.OpenStackClients(context).cinder()
+        volume_types = [i.name for i in c_client.volume_types.list()]
+        driver_utils.set_cached(
+            _VOLUME_TYPE_CACHE,
+            context.project_id,
+            volume_types,
+            _VOLUME_TYPE_CACHE_SECONDS,
+        )
+        return volume_types
+
     def _storageclass_definitions(self, context, cluster):
         """Query cinder API to retrieve list of available volume types.
 
         @return dict(dict,list(dict)) containing storage classes
         """
-        LOG.debug("Retrieve volume types from cinder for StorageClasses.")
-        client = clients.OpenStackClients(context)
         availability_zone = self._get_csi_cinder_availability_zone(cluster)
-        c_client = client.cinder()
-        volume_types = [i.name for i in c_client.volume_types.list()]
+        volume_types = self._get_volume_type_names(context)
         # Use the default volume type if defined. Otherwise use the first
         # type returned by cinder.
         default_volume_type = CONF.capi_helm.csi_cinder_default_volume_type
@@ -780,6 +967,8 @@ class Driver(driver.Driver):
                 f" Using {default_volume_type}."
             )
         elif default_volume_type not in volume_types:
+            # Make sure a retry sees any volume type created since
+            _VOLUME_TYPE_CACHE.pop(context.project_id, None)
             # If default does not exist throw an error.
             raise exception.MagnumException(
                 message=f"{default_volume_type} is not a"
@@ -787,21 +976,23 @@ class Driver(driver.Driver):
             )
         default_storage_class = {}
         additional_storage_classes = []
-        allow_expansion = self._get_csi_cinder_allow_volume_expansion(cluster)
-        reclaim_policy = self._get_csi_cinder_reclaim_policy(cluster)
-        allowed_topologies = CONF.capi_helm.csi_cinder_allowed_topologies
-        fstype = self._get_csi_cinder_fstype(cluster)
+        # These are the same for every volume type
+        common = {
+            "reclaimPolicy": self._get_csi_cinder_reclaim_policy(cluster),
+            "allowVolumeExpansion": (
+                self._get_csi_cinder_allow_volume_expansion(cluster)
+            ),
+            "availabilityZone": availability_zone,
+            "allowedTopologies": CONF.capi_helm.csi_cinder_allowed_topologies,
+            "fstype": self._get_csi_cinder_fstype(cluster),
+            "enabled": True,
+        }
 
         for volume_type in volume_types:
             storage_class = {
+                **common,
                 "name": driver_utils.sanitized_name(volume_type),
-                "reclaimPolicy": reclaim_policy,
-                "allowVolumeExpansion": allow_expansion,
-                "availabilityZone": availability_zone,
                 "volumeType": volume_type,
-                "allowedTopologies": allowed_topologies,
-                "fstype": fstype,
-                "enabled": True,
             }
             if volume_type == default_volume_type:
                 default_storage_class = storage_class
@@ -812,9 +1003,9 @@ class Driver(driver.Driver):
             additionalStorageClasses=additional_storage_classes,
         )
 
-    def _process_node_groups(self, cluster):
-        nodegroups = cluster.nodegroups
+    def _process_node_groups(self, cluster, nodegroups):
         nodegroup_set = []
+        autoscale_enabled = self._get_autoscale_enabled(cluster)
         for ng in nodegroups:
             if ng.role != NODE_GROUP_ROLE_CONTROLLER:
                 nodegroup_item = dict(
@@ -822,9 +1013,11 @@ class Driver(driver.Driver):
                     machineFlavor=ng.flavor_id,
                     machineCount=ng.node_count,
                 )
-                if self._get_autoscale_enabled(cluster):
-                    values = self._get_autoscale_values(cluster, ng)
-                    nodegroup_item = helm.mergeconcat(nodegroup_item, values)
+                if autoscale_enabled:
+                    # The autoscale values never overlap with the above
+                    nodegroup_item.update(
+                        self._get_autoscale_values(cluster, ng)
+                    )
                 nodegroup_set.append(nodegroup_item)
         return nodegroup_set
 
@@ -832,12 +1025,55 @@ class Driver(driver.Driver):
         if nodegroups is None:
             nodegroups = cluster.nodegroups
 
-        image_id, kube_version, os_distro = self._get_image_details(
-            context, cluster.cluster_template.image_id
-        )
+        # These are used in more than one place in the values
+        octavia_provider = self._get_octavia_provider(cluster)
+        autoheal_enabled = self._get_autoheal_enabled(cluster)
 
-        network_id = self._get_fixed_network_id(context, cluster)
-        subnet_id = neutron.get_fixed_subnet_id(context, cluster.fixed_subnet)
+        # Each of these is a separate call to an OpenStack API, so make
+        # them at the same time as the storage classes are worked out.
+        # Anything read from the cluster is read here, not in the workers
+        cluster_template = cluster.cluster_template
+        image_future = _get_executor().submit(
+            self._get_image_details, context, cluster_template.image_id
+        )
+        network_future = _get_executor().submit(
+            self._get_fixed_network_id, context, cluster.fixed_network
+        )
+        subnet_future = _get_executor().submit(
+            neutron.get_fixed_subnet_id, context, cluster.fixed_subnet
+        )
+        external_network_future = _get_executor().submit(
+            neutron.get_external_network_id,
+            context,
+            cluster_template.external_network_id,
+        )
+        lookups = (
+            image_future,
+            network_future,
+            subnet_future,
+            external_network_future,
+        )
+        try:
+            storage_classes = self._storageclass_definitions(context, cluster)
+            image_id, kube_version, os_distro = image_future.result()
+            network_id = network_future.result()
+            subnet_id = subnet_future.result()
+            external_network_id = external_network_future.result()
+        except Exception as exc:
+            # Cancel the lookups that haven't started yet, without waiting
+            # for those still running. Log the errors of any others that
+            # already failed, as only the first error is raised.
+            for future in lookups:
+                if future.cancel() or not future.done():
+                    continue
+                error = future.exception()
+                if error is not None and error is not exc:
+                    LOG.warning(
+                        "OpenStack lookup failed for cluster %s: %s",
+                        cluster.uuid,
+                        error,
+                    )
+            raise
 
         values = {
             "kubernetesVersion": kube_version,
@@ -847,13 +1083,11 @@ class Driver(driver.Driver):
             "etcd": self._get_etcd_config(cluster),
             "apiServer": {
                 "enableLoadBalancer": True,
-                "loadBalancerProvider": self._get_octavia_provider(cluster),
+                "loadBalancerProvider": octavia_provider,
             },
             "clusterNetworking": {
                 "dnsNameservers": self._get_dns_nameservers(cluster),
-                "externalNetworkId": neutron.get_external_network_id(
-                    context, cluster.cluster_template.external_network_id
-                ),
+                "externalNetworkId": external_network_id,
                 "internalNetwork": {
                     "networkFilter": (
                         {"id": network_id} if network_id else None
@@ -870,23 +1104,21 @@ class Driver(driver.Driver):
                 "machineFlavor": cluster.master_flavor_id,
                 "machineCount": cluster.master_count,
                 "healthCheck": {
-                    "enabled": self._get_autoheal_enabled(cluster),
+                    "enabled": autoheal_enabled,
                 },
             },
             "nodeGroupDefaults": {
                 "healthCheck": {
-                    "enabled": self._get_autoheal_enabled(cluster),
+                    "enabled": autoheal_enabled,
                 },
             },
-            "nodeGroups": self._process_node_groups(cluster),
+            "nodeGroups": self._process_node_groups(cluster, nodegroups),
             "addons": {
                 "openstack": {
-                    "csiCinder": self._storageclass_definitions(
-                        context, cluster
-                    ),
+                    "csiCinder": storage_classes,
                     "cloudConfig": {
                         "LoadBalancer": {
-                            "lb-provider": self._get_octavia_provider(cluster),
+                            "lb-provider": octavia_provider,
                             "lb-method": self._get_octavia_lb_algorithm(
                                 cluster
                             ),
@@ -908,81 +1140,57 @@ class Driver(driver.Driver):
             },
         }
 
+        # The optional settings below are written straight into the values
+        # built above, as none of them overlap with what is already there
+        control_plane = values["controlPlane"]
+        node_group_defaults = values["nodeGroupDefaults"]
+
         # Add boot disk details, if defined in config file.
         # Helm chart defaults to ephemeral disks, if unset.
         boot_volume_type = self._label(
             cluster, "boot_volume_type", CONF.cinder.default_boot_volume_type
         )
         if boot_volume_type:
-            disk_type_details = {
-                "controlPlane": {
-                    "machineRootVolume": {
-                        "volumeType": boot_volume_type,
-                    }
-                },
-                "nodeGroupDefaults": {
-                    "machineRootVolume": {
-                        "volumeType": boot_volume_type,
-                    }
-                },
-            }
-            values = helm.mergeconcat(values, disk_type_details)
+            for machine_values in (control_plane, node_group_defaults):
+                machine_values.setdefault("machineRootVolume", {})[
+                    "volumeType"
+                ] = boot_volume_type
 
         boot_volume_size_gb = self._get_label_int(
             cluster, "boot_volume_size", CONF.cinder.default_boot_volume_size
         )
         if boot_volume_size_gb:
-            disk_size_details = {
-                "controlPlane": {
-                    "machineRootVolume": {
-                        "diskSize": boot_volume_size_gb,
-                    }
-                },
-                "nodeGroupDefaults": {
-                    "machineRootVolume": {
-                        "diskSize": boot_volume_size_gb,
-                    }
-                },
-            }
-            values = helm.mergeconcat(values, disk_size_details)
+            for machine_values in (control_plane, node_group_defaults):
+                machine_values.setdefault("machineRootVolume", {})[
+                    "diskSize"
+                ] = boot_volume_size_gb
 
         # Sometimes you need to add an extra network
         # for things like Cinder CSI CephFS Native
         extra_network_name = self._label(cluster, "extra_network_name", "")
         if extra_network_name:
-            network_details = {
-                "nodeGroupDefaults": {
-                    "machineNetworking": {
-                        "ports": [
-                            {},
-                            {
-                                "network": {
-                                    "name": extra_network_name,
-                                },
-                                "securityGroups": [],
-                            },
-                        ],
+            node_group_defaults["machineNetworking"] = {
+                "ports": [
+                    {},
+                    {
+                        "network": {
+                            "name": extra_network_name,
+                        },
+                        "securityGroups": [],
                     },
-                },
+                ],
             }
-            values = helm.mergeconcat(values, network_details)
 
         if self._get_k8s_keystone_auth_enabled(cluster):
-            k8s_keystone_auth_config = {
-                "authWebhook": "k8s-keystone-auth",
-                "addons": {
-                    "openstack": {
-                        "k8sKeystoneAuth": {  # addon subchart configuration
-                            "enabled": True,
-                            "values": {
-                                "openstackAuthUrl": context.auth_url,
-                                "projectId": context.project_id,
-                            },
-                        }
-                    }
+            values["authWebhook"] = "k8s-keystone-auth"
+            # addon subchart configuration
+            values["addons"]["openstack"]["k8sKeystoneAuth"] = {
+                "enabled": True,
+                "values": {
+                    "openstackAuthUrl": context.auth_url,
+                    "projectId": context.project_id,
                 },
             }
-            values = helm.mergeconcat(values, k8s_keystone_auth_config)
             LOG.debug(
                 "Enable K8s keystone auth webhook for"
                 f" project: {context.project_id} auth url: {context.auth_url}"
@@ -990,10 +1198,7 @@ class Driver(driver.Driver):
 
         api_lb_allowed_cidrs = self._get_allowed_cidrs(cluster)
         if isinstance(api_lb_allowed_cidrs, list):
-            allowed_cidrs_config = {
-                "apiServer": {"allowedCidrs": api_lb_allowed_cidrs}
-            }
-            values = helm.mergeconcat(values, allowed_cidrs_config)
+            values["apiServer"]["allowedCidrs"] = api_lb_allowed_cidrs
 
         self._helm_client.install_or_upgrade(
             driver_utils.chart_release_name(cluster),
@@ -1053,6 +1258,17 @@ class Driver(driver.Driver):
             "Updating a cluster in this way is not currently supported"
         )
 
+    def _mark_nodegroups(self, nodegroups, status):
+        """Sets the status of each node group that doesn't have it yet.
+
+        Each save is a separate database write, so node groups that
+        already have the status are not saved again.
+        """
+        for nodegroup in nodegroups:
+            if nodegroup.status != status:
+                nodegroup.status = status
+                nodegroup.save()
+
     def delete_cluster(self, context, cluster):
         LOG.info("Starting to delete cluster %s", cluster.uuid)
 
@@ -1060,9 +1276,9 @@ class Driver(driver.Driver):
         # as delete in progress here, as note done by conductor
         # We do this before calling uninstall_release because
         # update_cluster_status can get called before we return
-        for ng in cluster.nodegroups:
-            ng.status = fields.ClusterStatus.DELETE_IN_PROGRESS
-            ng.save()
+        self._mark_nodegroups(
+            cluster.nodegroups, fields.ClusterStatus.DELETE_IN_PROGRESS
+        )
 
         release_name = driver_utils.chart_release_name(cluster)
         # Only attempt deletion of CAPI resources if they were created in
@@ -1104,12 +1320,17 @@ class Driver(driver.Driver):
         # TODO(mkjpryor) check that the upgrade is viable
         # e.g. not a downgrade, not an upgrade by more than one minor version
 
+        # Check all the flavors before saving anything, so an invalid
+        # flavor doesn't leave only some of the nodegroups marked
+        nodegroups = cluster.nodegroups
+        for nodegroup in nodegroups:
+            self._validate_allowed_flavor(context, nodegroup.flavor_id)
+
         # Updating the template will likely apply for all nodegroups
         # So mark them all as having an update in progress
-        for nodegroup in cluster.nodegroups:
-            nodegroup.status = fields.ClusterStatus.UPDATE_IN_PROGRESS
-            self._validate_allowed_flavor(context, nodegroup.flavor_id)
-            nodegroup.save()
+        self._mark_nodegroups(
+            nodegroups, fields.ClusterStatus.UPDATE_IN_PROGRESS
+        )
 
         # Move the cluster to the new template
         cluster.cluster_template_id = cluster_template.uuid
@@ -1117,7 +1338,9 @@ class Driver(driver.Driver):
         cluster.save()
         cluster.refresh()
 
-        self._update_helm_release(context, cluster)
+        # The nodegroups were saved above, so there is no need to load
+        # them from the database again
+        self._update_helm_release(context, cluster, nodegroups)
 
     def create_nodegroup(self, context, cluster, nodegroup):
         nodegroup.status = fields.ClusterStatus.CREATE_IN_PROGRESS
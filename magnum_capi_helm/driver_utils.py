@@ -12,31 +12,64 @@
 
 # Collection of static functions that are shared within the driver.
 
+import functools
 import re
+import time
 
 from magnum_capi_helm import conf
 
 CONF = conf.CONF
 
+_NOT_ALPHANUMERIC = re.compile("[^a-z0-9]")
+_NOT_ALPHANUMERIC_RUN = re.compile("[^a-z0-9]+")
 
-def cluster_namespace(cluster):
-    # We create clusters in a project-specific namespace
+
+@functools.lru_cache(maxsize=1024)
+def _project_namespace(prefix, project_id):
     # To generate the namespace, first sanitize the project id
-    project_id = re.sub("[^a-z0-9]", "", cluster.project_id.lower())
-    prefix = CONF.capi_helm.namespace_prefix
+    project_id = _NOT_ALPHANUMERIC.sub("", project_id.lower())
     return f"{prefix}-{project_id}"
 
 
+def cluster_namespace(cluster):
+    # We create clusters in a project-specific namespace
+    return _project_namespace(
+        CONF.capi_helm.namespace_prefix, cluster.project_id
+    )
+
+
 def sanitized_name(name, suffix=None):
     if not name:
         return None
-    return re.sub(
-        "[^a-z0-9]+",
+    return _NOT_ALPHANUMERIC_RUN.sub(
         "-",
         (f"{name}-{suffix}" if suffix else name).lower(),
     ).strip("-")
 
 
+def get_cached(cache, key):
+    # Entries are (expiry, value) pairs, as written by set_cached
+    entry = cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def set_cached(cache, key, value, seconds, max_size=None):
+    now = time.monotonic()
+    # Drop expired entries as we go, so the cache only holds the keys
+    # that were used recently rather than every project ever seen
+    for old_key, (expiry, _) in list(cache.items()):
+        if expiry <= now:
+            cache.pop(old_key, None)
+    if max_size and len(cache) >= max_size and key not in cache:
+        # All entries in a cache live for the same time, so the one that
+        # expires first is the one that was written longest ago
+        oldest = min(cache, key=lambda k: cache[k][0])
+        cache.pop(oldest, None)
+    cache[key] = (now + seconds, value)
+
+
 def chart_release_name(cluster):
     return cluster.stack_id
 
@@ -11,11 +11,12 @@
 # under the License.
 
 import base64
-import copy
+import itertools
 import os
 import pathlib
-import re
 import tempfile
+import threading
+import weakref
 import yaml
 
 from oslo_log import log as logging
@@ -27,6 +28,39 @@ from magnum_capi_helm import conf
 LOG = logging.getLogger(__name__)
 CONF = conf.CONF
 
+# Asks the API server to list objects with only their metadata, falling
+# back to the full objects if it can't do that, rather than failing
+_PARTIAL_OBJECT_METADATA_LIST = (
+    "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,"
+    "application/json"
+)
+
+
+class _ClientCache(threading.local):
+    """Clients loaded from each kubeconfig path, with the file's mtime.
+
+    requests does not promise that a Session is thread safe, so each
+    thread loads and keeps its own clients.
+    """
+
+    def __init__(self):
+        self.by_path = {}
+
+
+_CLIENTS = _ClientCache()
+
+# Use the libyaml parser when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _remove_files(file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except (OSError, FileNotFoundError):
+            pass
+    file_paths.clear()
+
 
 def ensure_file_cert(obj, file_key):
     """Returns the path and cleanup requirements of cert.
@@ -62,6 +96,9 @@ class Client(requests.Session):
     def __init__(self, kubeconfig):
         super().__init__()
         self._tempfiles = []
+        # Remove any temporary certificate files this class owns when the
+        # client is closed, garbage collected, or at the latest on exit
+        self._cleanup = weakref.finalize(self, _remove_files, self._tempfiles)
         cluster, user = self._get_cluster_and_user(kubeconfig)
 
         self.server = cluster["server"].rstrip("/")
@@ -87,36 +124,33 @@ class Client(requests.Session):
         assert client_key is not None
         self.cert = (client_cert, client_key)
 
+    def close(self):
+        super().close()
+        self._cleanup()
+
     def __del__(self):
-        # Remove any temporary certificate files this class owns.
-        for file_path in self._tempfiles:
-            try:
-                os.remove(file_path)
-            except (OSError, FileNotFoundError):
-                pass
-        self._tempfiles = []
+        self._cleanup()
 
     def _get_cluster_and_user(self, kubeconfig):
         # get the context
         current_context = kubeconfig["current-context"]
-        context = [
-            c["context"]
-            for c in kubeconfig["contexts"]
-            if c["name"] == current_context
-        ][0]
+        context = self._find_by_name(
+            kubeconfig["contexts"], "context", current_context
+        )
         # extract cluster and user from context
-        cluster = [
-            c["cluster"]
-            for c in kubeconfig["clusters"]
-            if c["name"] == context["cluster"]
-        ][0]
-        user = [
-            u["user"]
-            for u in kubeconfig["users"]
-            if u["name"] == context["user"]
-        ][0]
+        cluster = self._find_by_name(
+            kubeconfig["clusters"], "cluster", context["cluster"]
+        )
+        user = self._find_by_name(kubeconfig["users"], "user", context["user"])
         return cluster, user
 
+    @staticmethod
+    def _find_by_name(entries, kind, name):
+        entry = next((e[kind] for e in entries if e["name"] == name), None)
+        if entry is None:
+            raise ValueError(f"kubeconfig has no {kind} named {name!r}")
+        return entry
+
     @classmethod
     def _get_kubeconfig_path(cls):
         # use config if specified
@@ -130,17 +164,30 @@ class Client(requests.Session):
     @classmethod
     def _load_kubeconfig(cls, path):
         with open(path) as fd:
-            return yaml.safe_load(fd)
+            return yaml.load(fd, Loader=_YAML_LOADER)
 
     @classmethod
     def load(cls):
         path = cls._get_kubeconfig_path()
+        # Reuse this thread's client, and its connection pool, until the
+        # kubeconfig file changes
+        # A closed client has removed its certificate files, so it
+        # can't be handed out again
+        mtime = os.stat(path).st_mtime_ns
+        cached = _CLIENTS.by_path.get(path)
+        if cached and cached[0] == mtime and cached[1]._cleanup.alive:
+            return cached[1]
         kubeconfig = cls._load_kubeconfig(path)
-        return Client(kubeconfig)
+        client = Client(kubeconfig)
+        # A replaced client is not closed here, as callers may still be
+        # using it. Its certificate files are removed once it is garbage
+        # collected.
+        _CLIENTS.by_path[path] = (mtime, client)
+        return client
 
     def request(self, method, url, *args, **kwargs):
         # Make sure to add the server to any relative URLs
-        if re.match(r"^http(s)://", url) is None:
+        if not url.startswith(("http://", "https://")):
             url = "{}{}".format(self.server, url)
         response = super().request(method, url, *args, **kwargs)
         LOG.debug(
@@ -172,6 +219,11 @@ class Client(requests.Session):
     def get_machine_deployment(self, name, namespace):
         return MachineDeployment(self).fetch(name, namespace)
 
+    def get_machine_deployments_by_label(self, labels, namespace):
+        return list(
+            MachineDeployment(self).fetch_all_by_label(labels, namespace)
+        )
+
     def get_manifests_by_label(self, labels, namespace):
         return list(Manifests(self).fetch_all_by_label(labels, namespace))
 
@@ -183,8 +235,23 @@ class Client(requests.Session):
         addons.extend(self.get_helm_releases_by_label(labels, namespace))
         return addons
 
-    def get_all_machines_by_label(self, labels, namespace):
-        return list(Machine(self).fetch_all_by_label(labels, namespace))
+    def iter_addons_by_label(self, labels, namespace):
+        """Yields addons, only listing each kind when it is reached.
+
+        This means callers that stop early, e.g. at the first addon that
+        is not deployed, can avoid listing helm releases altogether.
+        """
+        yield from Manifests(self).fetch_all_by_label(labels, namespace)
+        yield from HelmRelease(self).fetch_all_by_label(labels, namespace)
+
+    def get_all_machines_by_label(
+        self, labels, namespace, limit=None, metadata_only=False
+    ):
+        machines = Machine(self).fetch_all_by_label(
+            labels, namespace, limit=limit, metadata_only=metadata_only
+        )
+        # Stop before fetching another page once we have enough
+        return list(itertools.islice(machines, limit))
 
 
 class Resource:
@@ -225,17 +292,33 @@ class Resource:
         else:
             response.raise_for_status()
 
-    def fetch_all_by_label(self, labels, namespace=None):
-        """Fetches objects matching the labels from the target cluster."""
+    def fetch_all_by_label(
+        self, labels, namespace=None, limit=None, metadata_only=False
+    ):
+        """Fetches objects matching the labels from the target cluster.
+
+        The labels can be given as a dict, or as a label selector string
+        that has already been built. If a limit is given, it is used as
+        the page size. If only the metadata is needed, the spec and status
+        of each object are left out of the response.
+        """
         assert self.namespaced == bool(namespace)
-        label_selector = ",".join(f"{k}={v}" for k, v in labels.items())
+        if isinstance(labels, str):
+            label_selector = labels
+        else:
+            label_selector = ",".join(f"{k}={v}" for k, v in labels.items())
+        kwargs = {}
+        if metadata_only:
+            kwargs["headers"] = {"Accept": _PARTIAL_OBJECT_METADATA_LIST}
         continue_token = ""
         while True:
             params = {"labelSelector": label_selector}
+            if limit:
+                params["limit"] = limit
             if continue_token:
                 params["continue"] = continue_token
             response = self.client.get(
-                self.prepare_path(namespace=namespace), params=params
+                self.prepare_path(namespace=namespace), params=params, **kwargs
             )
             response.raise_for_status()
             response_data = response.json()
@@ -247,10 +330,13 @@ class Resource:
     def apply(self, name, data=None, namespace=None):
         """Applies the given object to the target Kubernetes cluster."""
         assert self.namespaced == bool(namespace)
-        body_data = copy.deepcopy(data) if data else {}
+        # Only the top level and the metadata are changed, so copy just
+        # those rather than deep copying the whole of the caller's data
+        body_data = dict(data) if data else {}
         body_data["apiVersion"] = self.api_version
         body_data["kind"] = self.kind
-        body_data.setdefault("metadata", {})["name"] = name
+        body_data["metadata"] = dict(body_data.get("metadata") or {})
+        body_data["metadata"]["name"] = name
         if namespace:
             body_data["metadata"]["namespace"] = namespace
         response = self.client.patch(
@@ -10,26 +10,71 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 import collections
+import pathlib
+import types
 from unittest import mock
 
 import keystoneauth1
 from magnum.common import clients
 from magnum.common import utils
-from magnum.tests.unit.db import base
+from magnum.tests import base
 from magnum.tests.unit.objects import utils as obj_utils
+import yaml
 
 from magnum_capi_helm.common import app_creds
+from magnum_capi_helm import driver_utils
 
+# What keystone returns when an application credential is created
+AppCred = collections.namedtuple("AppCred", ["id", "secret"])
+
+TEST_CLOUDS = {
+    "clouds": {
+        "openstack": {
+            "auth": {
+                "application_credential_id": "id",
+                "application_credential_secret": "pass",
+                "auth_url": "http://keystone",
+            },
+            "auth_type": "v3applicationcredential",
+            "identity_api_version": 3,
+            "interface": "public",
+            "region_name": "cinder",
+            "verify": True,
+        }
+    }
+}
+
+
+class TestAppCreds(base.TestCase):
+    _NOT_FOUND = keystoneauth1.exceptions.http.NotFound
 
-class TestAppCreds(base.DbTestCase):
     def setUp(self):
         super().setUp()
-        self.cluster_obj = obj_utils.create_test_cluster(
+        # Only the cluster's identifiers are used, so there is no need
+        # to set up the database and write the cluster to it
+        self.cluster_obj = obj_utils.get_test_cluster(
             self.context,
             name="cluster_example_$A",
             master_flavor_id="flavor_small",
             flavor_id="flavor_medium",
         )
+        self.app_cred_name = f"magnum-{self.cluster_obj.uuid}"
+        self.addCleanup(app_creds._get_certifi_ca_bundle.cache_clear)
+        self.addCleanup(app_creds._CLOUD_LOCATION_CACHE.clear)
+
+        # Patch the OpenStack clients once, with the values that every
+        # test expects, rather than building the mocks in each test
+        self.patcher = mock.patch.object(
+            clients, "OpenStackClients", autospec=True
+        )
+        mock_client = self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+        self.mock_osc = mock_client.return_value
+        self.mock_osc.cinder_region_name.return_value = "cinder"
+        self.mock_osc.url_for.return_value = "http://keystone"
+        self.mock_app_cred = (
+            self.mock_osc.keystone.return_value.client.application_credentials
+        )
 
     @mock.patch.object(utils, "get_openstack_ca")
     def test_get_openstack_ca_certificate(self, mock_ca):
@@ -47,56 +92,116 @@ class TestAppCreds(base.DbTestCase):
 
         self.assertIsNotNone(cert)
 
-    @mock.patch.object(clients, "OpenStackClients")
-    def test_create_app_cred(self, mock_client):
-        mock_client().cinder_region_name.return_value = "cinder"
-        mock_client().url_for.return_value = "http://keystone"
-        mock_app_cred = mock_client().keystone().client.application_credentials
-        app_cred = collections.namedtuple("appcred", ["id", "secret"])
-        mock_app_cred.create.return_value = app_cred("id", "pass")
-        context = mock.MagicMock()
-        context.roles = ["member", "foo", "admin"]
+    @mock.patch.object(utils, "get_openstack_ca")
+    def test_get_openstack_ca_certificate_certifi_read_once(self, mock_ca):
+        mock_ca.return_value = None
+        app_creds._get_certifi_ca_bundle.cache_clear()
+
+        with mock.patch.object(
+            pathlib.Path, "read_bytes", autospec=True, return_value=b"certifi"
+        ) as mock_read:
+            first = app_creds._get_openstack_ca_certificate()
+            second = app_creds._get_openstack_ca_certificate()
+
+        self.assertEqual("certifi", first)
+        self.assertEqual("certifi", second)
+        mock_read.assert_called_once()
+
+    @mock.patch.object(app_creds, "_get_certifi_ca_bundle")
+    @mock.patch.object(utils, "get_openstack_ca")
+    def test_get_openstack_ca_certificate_configured(
+        self, mock_ca, mock_certifi
+    ):
+        mock_ca.return_value = "cert"
+
+        app_creds._get_openstack_ca_certificate()
+
+        mock_certifi.assert_not_called()
+
+    def test_create_app_cred(self):
+        mock_create = self.mock_app_cred.create
+        mock_create.return_value = AppCred("id", "pass")
+        context = types.SimpleNamespace(
+            project_id="fake_project", roles=["member", "foo", "admin"]
+        )
 
         app_cred = app_creds._create_app_cred(context, self.cluster_obj)
 
-        expected = {
-            "clouds": {
-                "openstack": {
-                    "auth": {
-                        "application_credential_id": "id",
-                        "application_credential_secret": "pass",
-                        "auth_url": "http://keystone",
-                    },
-                    "auth_type": "v3applicationcredential",
-                    "identity_api_version": 3,
-                    "interface": "public",
-                    "region_name": "cinder",
-                    "verify": True,
-                }
-            }
-        }
-        self.assertEqual(expected, app_cred)
-        mock_client().url_for.assert_called_once_with(
+        self.assertEqual(TEST_CLOUDS, app_cred)
+        self.mock_osc.url_for.assert_called_once_with(
             service_type="identity", interface="public"
         )
-        mock_app_cred.create.assert_called_once_with(
+        mock_create.assert_called_once_with(
             user="fake_user",
-            name=f"magnum-{self.cluster_obj.uuid}",
+            name=self.app_cred_name,
             description=f"Magnum cluster ({self.cluster_obj.uuid})",
             # roles=["member", "foo"],
         )
 
-    @mock.patch.object(app_creds, "_get_openstack_ca_certificate")
-    @mock.patch.object(app_creds, "_create_app_cred")
-    def test_get_app_cred_yaml(self, mock_create, mock_ca):
-        mock_ca.return_value = "cacert"
-        mock_create.return_value = {
-            "clouds": {
-                "openstack": {"auth": {"application_credential_id": "id"}}
-            }
-        }
+    def test_create_app_cred_cloud_location_cached(self):
+        context = types.SimpleNamespace(project_id="fake_project")
+
+        app_creds._create_app_cred(context, self.cluster_obj)
+        app_cred = app_creds._create_app_cred(context, self.cluster_obj)
+
+        cloud = app_cred["clouds"]["openstack"]
+        self.assertEqual("cinder", cloud["region_name"])
+        self.assertEqual("http://keystone", cloud["auth"]["auth_url"])
+        self.mock_osc.cinder_region_name.assert_called_once_with()
+        self.mock_osc.url_for.assert_called_once_with(
+            service_type="identity", interface="public"
+        )
+
+    def test_create_app_cred_region_cached_across_projects(self):
+        context = types.SimpleNamespace(project_id="fake_project")
+        other_context = types.SimpleNamespace(project_id="other_project")
+
+        app_creds._create_app_cred(context, self.cluster_obj)
+        app_creds._create_app_cred(other_context, self.cluster_obj)
+
+        self.mock_osc.cinder_region_name.assert_called_once_with()
+        self.assertEqual(2, self.mock_osc.url_for.call_count)
+
+    def test_create_app_cred_cloud_location_bounded(self):
+        for idx in range(app_creds._CLOUD_LOCATION_CACHE_SIZE + 1):
+            context = types.SimpleNamespace(project_id=f"project{idx}")
+            app_creds._create_app_cred(context, self.cluster_obj)
+
+        self.assertEqual(
+            app_creds._CLOUD_LOCATION_CACHE_SIZE,
+            len(app_creds._CLOUD_LOCATION_CACHE),
+        )
+        # The oldest entries made way for the newest projects
+        self.assertNotIn(
+            ("identity", "project0"), app_creds._CLOUD_LOCATION_CACHE
+        )
+
+    @mock.patch.object(driver_utils.time, "monotonic")
+    def test_create_app_cred_cloud_location_expires(self, mock_time):
+        context = types.SimpleNamespace(project_id="fake_project")
+        mock_time.return_value = 1000
+        app_creds._create_app_cred(context, self.cluster_obj)
+
+        mock_time.return_value = 1000 + app_creds._CLOUD_LOCATION_CACHE_SECONDS
+        app_creds._create_app_cred(context, self.cluster_obj)
+
+        self.assertEqual(2, self.mock_osc.cinder_region_name.call_count)
+        self.assertEqual(2, self.mock_osc.url_for.call_count)
 
-        app_cred = app_creds.get_app_cred_string_data("context", "cluster")
+    @mock.patch.multiple(
+        app_creds,
+        _get_openstack_ca_certificate=mock.DEFAULT,
+        _create_app_cred=mock.DEFAULT,
+    )
+    def test_get_app_cred_yaml(
+        self, _get_openstack_ca_certificate, _create_app_cred
+    ):
+        _get_openstack_ca_certificate.return_value = "cacert"
+        _create_app_cred.return_value = TEST_CLOUDS
+
+        app_cred = app_creds.get_app_cred_string_data(
+            mock.sentinel.context, mock.sentinel.cluster
+        )
 
         expected = {
             "cacert": "cacert",
@@ -104,33 +209,62 @@ class TestAppCreds(base.DbTestCase):
 clouds:
   openstack:
     auth:
-      application_credential_id: id
+      application_credential_id: "id"
+      application_credential_secret: "pass"
+      auth_url: "http://keystone"
+    auth_type: v3applicationcredential
+    identity_api_version: 3
+    interface: "public"
+    region_name: "cinder"
+    verify: true
 """,
         }
         self.assertEqual(expected, app_cred)
+        self.assertEqual(TEST_CLOUDS, yaml.safe_load(app_cred["clouds.yaml"]))
+        _create_app_cred.assert_called_once_with(
+            mock.sentinel.context, mock.sentinel.cluster
+        )
+
+    def test_render_clouds_yaml_escapes_values(self):
+        app_cred_dict = {
+            "clouds": {
+                "openstack": {
+                    "auth": {
+                        "application_credential_id": "id: {x}",
+                        "application_credential_secret": 'p"a\\ss#\n',
+                        "auth_url": "https://keystone:5000/v3",
+                    },
+                    "auth_type": "v3applicationcredential",
+                    "identity_api_version": 3,
+                    "interface": "internal",
+                    "region_name": "Region{One}",
+                    "verify": False,
+                }
+            }
+        }
+
+        clouds_yaml = app_creds._render_clouds_yaml(app_cred_dict)
+
+        self.assertEqual(app_cred_dict, yaml.safe_load(clouds_yaml))
 
-    @mock.patch.object(clients, "OpenStackClients")
-    def test_delete_app_cred(self, mock_client):
-        mock_app_cred = mock_client().keystone().client.application_credentials
-        mock_find = mock.MagicMock()
-        mock_app_cred.find.return_value = mock_find
+    def test_delete_app_cred(self):
+        mock_find = self.mock_app_cred.find
 
-        app_creds.delete_app_cred("context", self.cluster_obj)
+        app_creds.delete_app_cred(mock.sentinel.context, self.cluster_obj)
 
-        mock_find.delete.assert_called_once_with()
-        mock_app_cred.find.assert_called_once_with(
-            name=f"magnum-{self.cluster_obj.uuid}",
+        mock_find.return_value.delete.assert_called_once_with()
+        mock_find.assert_called_once_with(
+            name=self.app_cred_name,
             user="fake_user",
         )
 
-    @mock.patch.object(clients, "OpenStackClients")
-    def test_delete_app_cred_not_found(self, mock_client):
-        mock_app_cred = mock_client().keystone().client.application_credentials
-        mock_app_cred.find.side_effect = keystoneauth1.exceptions.http.NotFound
+    def test_delete_app_cred_not_found(self):
+        mock_find = self.mock_app_cred.find
+        mock_find.side_effect = self._NOT_FOUND
 
-        app_creds.delete_app_cred("context", self.cluster_obj)
+        app_creds.delete_app_cred(mock.sentinel.context, self.cluster_obj)
 
-        mock_app_cred.find.assert_called_once_with(
-            name=f"magnum-{self.cluster_obj.uuid}",
+        mock_find.assert_called_once_with(
+            name=self.app_cred_name,
             user="fake_user",
         )
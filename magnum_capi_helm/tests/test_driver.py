@@ -9,11 +9,13 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+from concurrent import futures
 from unittest import mock
 from uuid import uuid4
 
 from magnum.common import exception
 from magnum.common import neutron
+from magnum import objects
 from magnum.objects import fields
 from magnum.tests.unit.db import base
 from magnum.tests.unit.objects import utils as obj_utils
@@ -33,6 +35,8 @@ CONF = conf.CONF
 class ClusterAPIDriverTest(base.DbTestCase):
     def setUp(self):
         super(ClusterAPIDriverTest, self).setUp()
+        self.addCleanup(driver._FLAVOR_CACHE.clear)
+        self.addCleanup(driver._VOLUME_TYPE_CACHE.clear)
         self.driver = driver.Driver()
         self.cluster_obj = obj_utils.create_test_cluster(
             self.context,
@@ -115,6 +119,48 @@ class ClusterAPIDriverTest(base.DbTestCase):
         mock_update.assert_called_once_with(self.cluster_obj, {"spec": {}})
         mock_delete.assert_not_called()
 
+    @mock.patch.object(driver.Driver, "_update_status_updating")
+    @mock.patch.object(driver.Driver, "_update_all_nodegroups_status")
+    @mock.patch.object(driver.Driver, "_get_capi_cluster")
+    def test_update_cluster_status_saves_once(
+        self, mock_capi, mock_ng, mock_update
+    ):
+        mock_ng.return_value = False
+        mock_capi.return_value = {
+            "spec": {"controlPlaneEndpoint": {"host": "foo", "port": 6443}}
+        }
+        self.cluster_obj.status = fields.ClusterStatus.CREATE_IN_PROGRESS
+        self.cluster_obj.obj_reset_changes()
+
+        def set_complete(cluster, capi_cluster):
+            cluster.status = fields.ClusterStatus.CREATE_COMPLETE
+
+        mock_update.side_effect = set_complete
+
+        with mock.patch.object(self.cluster_obj, "save") as mock_save:
+            self.driver.update_cluster_status(self.context, self.cluster_obj)
+
+        mock_save.assert_called_once_with()
+        self.assertEqual("https://foo:6443", self.cluster_obj.api_address)
+        self.assertEqual(
+            fields.ClusterStatus.CREATE_COMPLETE, self.cluster_obj.status
+        )
+
+    @mock.patch.object(driver.Driver, "_update_all_nodegroups_status")
+    @mock.patch.object(driver.Driver, "_get_capi_cluster")
+    def test_update_cluster_status_unchanged_not_saved(
+        self, mock_capi, mock_ng
+    ):
+        mock_ng.return_value = False
+        mock_capi.return_value = {"spec": {}}
+        self.cluster_obj.status = fields.ClusterStatus.CREATE_COMPLETE
+        self.cluster_obj.obj_reset_changes()
+
+        with mock.patch.object(self.cluster_obj, "save") as mock_save:
+            self.driver.update_cluster_status(self.context, self.cluster_obj)
+
+        mock_save.assert_not_called()
+
     @mock.patch.object(driver.Driver, "_update_status_deleting")
     @mock.patch.object(driver.Driver, "_update_status_updating")
     @mock.patch.object(driver.Driver, "_update_all_nodegroups_status")
@@ -163,10 +209,13 @@ class ClusterAPIDriverTest(base.DbTestCase):
         mock_update.assert_not_called()
         mock_delete.assert_not_called()
 
+    @mock.patch.object(kubernetes.Client, "load")
+    @mock.patch.object(driver.Driver, "_get_kubeadm_control_plane")
+    @mock.patch.object(driver.Driver, "_get_machine_deployments")
     @mock.patch.object(driver.Driver, "_update_worker_nodegroup_status")
     @mock.patch.object(driver.Driver, "_update_control_plane_nodegroup_status")
     def test_update_all_nodegroups_status_not_in_progress(
-        self, mock_cp, mock_w
+        self, mock_cp, mock_w, mock_mds, mock_kcp, mock_load
     ):
         control_plane = [
             ng
@@ -185,12 +234,18 @@ class ClusterAPIDriverTest(base.DbTestCase):
             for ng in self.cluster_obj.nodegroups
             if ng.role == driver.NODE_GROUP_ROLE_CONTROLLER
         ][0]
-        mock_cp.assert_called_once_with(self.cluster_obj, mock.ANY)
+        mock_cp.assert_called_once_with(
+            self.cluster_obj, mock.ANY, mock_kcp.return_value
+        )
         self.assertEqual(
             control_plane.obj_to_primitive(),
             mock_cp.call_args_list[0][0][1].obj_to_primitive(),
         )
-        mock_w.assert_called_once_with(self.cluster_obj, mock.ANY)
+        mock_kcp.assert_called_once_with(self.cluster_obj)
+        mock_mds.assert_called_once_with(self.cluster_obj)
+        mock_w.assert_called_once_with(
+            self.cluster_obj, mock.ANY, mock_mds.return_value
+        )
         worker = [
             ng
             for ng in self.cluster_obj.nodegroups
@@ -201,9 +256,14 @@ class ClusterAPIDriverTest(base.DbTestCase):
             mock_w.call_args_list[0][0][1].obj_to_primitive(),
         )
 
+    @mock.patch.object(kubernetes.Client, "load")
+    @mock.patch.object(driver.Driver, "_get_kubeadm_control_plane")
+    @mock.patch.object(driver.Driver, "_get_machine_deployments")
     @mock.patch.object(driver.Driver, "_update_worker_nodegroup_status")
     @mock.patch.object(driver.Driver, "_update_control_plane_nodegroup_status")
-    def test_update_all_nodegroups_status_in_progress(self, mock_cp, mock_w):
+    def test_update_all_nodegroups_status_in_progress(
+        self, mock_cp, mock_w, mock_mds, mock_kcp, mock_load
+    ):
         control_plane = [
             ng
             for ng in self.cluster_obj.nodegroups
@@ -216,8 +276,120 @@ class ClusterAPIDriverTest(base.DbTestCase):
         result = self.driver._update_all_nodegroups_status(self.cluster_obj)
 
         self.assertTrue(result)
-        mock_cp.assert_called_once_with(self.cluster_obj, mock.ANY)
-        mock_w.assert_called_once_with(self.cluster_obj, mock.ANY)
+        mock_cp.assert_called_once_with(
+            self.cluster_obj, mock.ANY, mock_kcp.return_value
+        )
+        mock_w.assert_called_once_with(
+            self.cluster_obj, mock.ANY, mock_mds.return_value
+        )
+
+    @mock.patch.object(driver.Driver, "_get_kubeadm_control_plane")
+    @mock.patch.object(driver.Driver, "_get_machine_deployments")
+    def test_get_nodegroup_resources_control_plane_only(
+        self, mock_mds, mock_kcp
+    ):
+        nodegroups = [
+            ng
+            for ng in self.cluster_obj.nodegroups
+            if ng.role == driver.NODE_GROUP_ROLE_CONTROLLER
+        ]
+
+        result = self.driver._get_nodegroup_resources(
+            self.cluster_obj, nodegroups
+        )
+
+        self.assertEqual((mock_kcp.return_value, {}), result)
+        mock_kcp.assert_called_once_with(self.cluster_obj)
+        mock_mds.assert_not_called()
+
+    @mock.patch.object(driver.Driver, "_get_kubeadm_control_plane")
+    @mock.patch.object(driver.Driver, "_get_machine_deployments")
+    def test_get_nodegroup_resources_control_plane_fails(
+        self, mock_mds, mock_kcp
+    ):
+        mock_kcp.side_effect = exception.MagnumException("kcp")
+
+        self.assertRaises(
+            exception.MagnumException,
+            self.driver._get_nodegroup_resources,
+            self.cluster_obj,
+            self.cluster_obj.nodegroups,
+        )
+
+    @mock.patch.object(driver.futures, "ThreadPoolExecutor")
+    def test_get_executor_size_from_config(self, mock_executor):
+        self.config(max_parallel_requests=64, group="capi_helm")
+        driver._get_executor.cache_clear()
+        self.addCleanup(driver._get_executor.cache_clear)
+
+        executor = driver._get_executor()
+
+        self.assertIs(mock_executor.return_value, executor)
+        self.assertIs(executor, driver._get_executor())
+        mock_executor.assert_called_once_with(max_workers=64)
+
+    @mock.patch.object(kubernetes.Client, "load")
+    def test_get_machine_deployments(self, mock_load):
+        mock_client = mock.MagicMock(spec=kubernetes.Client)
+        mock_load.return_value = mock_client
+        md = {"metadata": {"name": "cluster-example-a-111111111111-workers"}}
+        mock_client.get_machine_deployments_by_label.return_value = [md]
+
+        result = self.driver._get_machine_deployments(self.cluster_obj)
+
+        self.assertEqual(
+            {"cluster-example-a-111111111111-workers": md}, result
+        )
+        mock_client.get_machine_deployments_by_label.assert_called_once_with(
+            {
+                "cluster.x-k8s.io/cluster-name": (
+                    "cluster-example-a-111111111111"
+                ),
+            },
+            "magnum-fakeproject",
+        )
+
+    @mock.patch.object(driver.Driver, "_update_nodegroup_status")
+    @mock.patch.object(kubernetes.Client, "load")
+    def test_update_worker_nodegroup_status_prefetched(
+        self, mock_load, mock_update
+    ):
+        mock_client = mock.MagicMock(spec=kubernetes.Client)
+        mock_load.return_value = mock_client
+        nodegroup = mock.MagicMock()
+        nodegroup.name = "workers"
+        md = {"status": {"phase": "Running"}}
+
+        self.driver._update_worker_nodegroup_status(
+            self.cluster_obj,
+            nodegroup,
+            {"cluster-example-a-111111111111-workers": md},
+        )
+
+        mock_client.get_machine_deployment.assert_not_called()
+        mock_update.assert_called_once_with(
+            self.cluster_obj, nodegroup, driver.NodeGroupState.READY
+        )
+
+    @mock.patch.object(driver.Driver, "_update_nodegroup_status")
+    @mock.patch.object(kubernetes.Client, "load")
+    def test_update_worker_nodegroup_status_prefetched_missing(
+        self, mock_load, mock_update
+    ):
+        mock_client = mock.MagicMock(spec=kubernetes.Client)
+        mock_load.return_value = mock_client
+        nodegroup = mock.MagicMock()
+        nodegroup.name = "workers"
+        nodegroup.status = fields.ClusterStatus.CREATE_IN_PROGRESS
+
+        self.driver._update_worker_nodegroup_status(
+            self.cluster_obj, nodegroup, {}
+        )
+
+        mock_client.get_machine_deployment.assert_not_called()
+        mock_update.assert_called_once_with(
+            self.cluster_obj, nodegroup, driver.NodeGroupState.NOT_PRESENT
+        )
 
     @mock.patch.object(driver.Driver, "_update_nodegroup_status")
     @mock.patch.object(kubernetes.Client, "load")
@@ -339,12 +511,14 @@ class ClusterAPIDriverTest(base.DbTestCase):
             "cluster-example-a-111111111111-workers", "magnum-fakeproject"
         )
         mock_client.get_all_machines_by_label.assert_called_once_with(
-            {
-                "capi.stackhpc.com/cluster": "cluster-example-a-111111111111",
-                "capi.stackhpc.com/component": "worker",
-                "capi.stackhpc.com/node-group": "workers",
-            },
+            (
+                "capi.stackhpc.com/cluster=cluster-example-a-111111111111,"
+                "capi.stackhpc.com/component=worker,"
+                "capi.stackhpc.com/node-group=workers"
+            ),
             "magnum-fakeproject",
+            limit=1,
+            metadata_only=True,
         )
         mock_update.assert_called_once_with(
             self.cluster_obj, nodegroup, driver.NodeGroupState.PENDING
@@ -371,12 +545,14 @@ class ClusterAPIDriverTest(base.DbTestCase):
             "cluster-example-a-111111111111-workers", "magnum-fakeproject"
         )
         mock_client.get_all_machines_by_label.assert_called_once_with(
-            {
-                "capi.stackhpc.com/cluster": "cluster-example-a-111111111111",
-                "capi.stackhpc.com/component": "worker",
-                "capi.stackhpc.com/node-group": "workers",
-            },
+            (
+                "capi.stackhpc.com/cluster=cluster-example-a-111111111111,"
+                "capi.stackhpc.com/component=worker,"
+                "capi.stackhpc.com/node-group=workers"
+            ),
             "magnum-fakeproject",
+            limit=1,
+            metadata_only=True,
         )
         nodegroup.destroy.assert_called_once_with()
         nodegroup.save.assert_not_called()
@@ -566,12 +742,14 @@ class ClusterAPIDriverTest(base.DbTestCase):
 
         self.assertTrue(result)
         mock_client.get_all_machines_by_label.assert_called_once_with(
-            {
-                "capi.stackhpc.com/cluster": "cluster-example-a-111111111111",
-                "capi.stackhpc.com/component": "worker",
-                "capi.stackhpc.com/node-group": "nodegroup1",
-            },
+            (
+                "capi.stackhpc.com/cluster=cluster-example-a-111111111111,"
+                "capi.stackhpc.com/component=worker,"
+                "capi.stackhpc.com/node-group=nodegroup1"
+            ),
             "magnum-fakeproject",
+            limit=1,
+            metadata_only=True,
         )
 
     @mock.patch.object(capi_monitor, "CAPIMonitor")
@@ -619,7 +797,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_condition_false(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = []
+        mock_client.iter_addons_by_label.return_value = []
         mock_load.return_value = mock_client
 
         self.cluster_obj.status = fields.ClusterStatus.CREATE_IN_PROGRESS
@@ -642,7 +820,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_ready_created(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = []
+        mock_client.iter_addons_by_label.return_value = []
         mock_load.return_value = mock_client
 
         self.cluster_obj.status = fields.ClusterStatus.CREATE_IN_PROGRESS
@@ -665,7 +843,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_addons_unknown(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = [
+        mock_client.iter_addons_by_label.return_value = [
             {
                 "metadata": {"name": "cni"},
                 "status": {},
@@ -697,7 +875,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_addons_installing(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = [
+        mock_client.iter_addons_by_label.return_value = [
             {
                 "metadata": {"name": "cni"},
                 "status": {"phase": "Deployed"},
@@ -729,7 +907,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_addons_deployed(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = [
+        mock_client.iter_addons_by_label.return_value = [
             {
                 "metadata": {"name": "cni"},
                 "status": {"phase": "Deployed"},
@@ -761,7 +939,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_addons_failed(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = [
+        mock_client.iter_addons_by_label.return_value = [
             {
                 "metadata": {"name": "cni"},
                 "status": {"phase": "Deployed"},
@@ -793,7 +971,7 @@ class ClusterAPIDriverTest(base.DbTestCase):
     @mock.patch.object(kubernetes.Client, "load")
     def test_update_status_updating_ready_updated(self, mock_load):
         mock_client = mock.MagicMock(spec=kubernetes.Client)
-        mock_client.get_addons_by_label.return_value = []
+        mock_client.iter_addons_by_label.return_value = []
         mock_load.return_value = mock_client
 
         self.cluster_obj.status = fields.ClusterStatus.UPDATE_IN_PROGRESS
@@ -960,6 +1138,15 @@ class ClusterAPIDriverTest(base.DbTestCase):
 
         self.assertEqual("magnum-123456f", namespace)
 
+    def test_namespace_prefix_changed(self):
+        self.cluster_obj.project_id = "123-456F"
+        driver_utils.cluster_namespace(self.cluster_obj)
+        self.config(namespace_prefix="other", group="capi_helm")
+
+        namespace = driver_utils.cluster_namespace(self.cluster_obj)
+
+        self.assertEqual("other-123456f", namespace)
+
     def test_label_return_default(self):
         self.cluster_obj.labels = dict()
         self.cluster_obj.cluster_template.labels = dict()
@@ -983,6 +1170,52 @@ class ClusterAPIDriverTest(base.DbTestCase):
 
         self.assertEqual("41", result)
 
+    def test_label_no_labels(self):
+        self.cluster_obj.labels = None
+        self.cluster_obj.cluster_template.labels = None
+
+        self.assertEqual(
+            "default", self.driver._label(self.cluster_obj, "foo", "default")
+        )
+
+    def test_get_dns_nameservers(self):
+        self.cluster_obj.cluster_template.dns_nameserver = "8.8.8.8, 1.1.1.1,"
+
+        self.assertEqual(
+            ["8.8.8.8", "1.1.1.1"],
+            self.driver._get_dns_nameservers(self.cluster_obj),
+        )
+
+    def test_get_allowed_cidrs(self):
+        self.cluster_obj.labels = {
+            "api_master_lb_allowed_cidrs": "10.0.0.0/8, 192.168.0.0/16,"
+        }
+
+        self.assertEqual(
+            ["10.0.0.0/8", "192.168.0.0/16"],
+            self.driver._get_allowed_cidrs(self.cluster_obj),
+        )
+
+    def test_get_allowed_cidrs_parsed_once(self):
+        driver._parse_cidrs.cache_clear()
+        self.addCleanup(driver._parse_cidrs.cache_clear)
+        self.cluster_obj.labels = {
+            "api_master_lb_allowed_cidrs": "10.0.0.0/8,192.168.0.0/16"
+        }
+
+        first = self.driver._get_allowed_cidrs(self.cluster_obj)
+        second = self.driver._get_allowed_cidrs(self.cluster_obj)
+
+        self.assertEqual(["10.0.0.0/8", "192.168.0.0/16"], second)
+        self.assertIsNot(first, second)
+        self.assertEqual(1, driver._parse_cidrs.cache_info().misses)
+        self.assertEqual(1, driver._parse_cidrs.cache_info().hits)
+
+    def test_get_allowed_cidrs_empty(self):
+        self.cluster_obj.labels = {"api_master_lb_allowed_cidrs": " , "}
+
+        self.assertFalse(self.driver._get_allowed_cidrs(self.cluster_obj))
+
     def test_sanitized_name_no_suffix(self):
         self.assertEqual(
             "123-456fab", driver_utils.sanitized_name("123-456Fab")
@@ -1282,6 +1515,82 @@ class ClusterAPIDriverTest(base.DbTestCase):
         )
         self.assertEqual([], mock_get_net.call_args_list)
 
+    @mock.patch.object(driver, "_get_executor")
+    @mock.patch.object(driver, "LOG")
+    @mock.patch.object(neutron, "get_fixed_subnet_id")
+    @mock.patch.object(
+        driver.Driver,
+        "_storageclass_definitions",
+        return_value=mock.ANY,
+    )
+    @mock.patch.object(driver.Driver, "_get_image_details", autospec=True)
+    @mock.patch.object(helm.Client, "install_or_upgrade", autospec=True)
+    def test_update_helm_release_lookup_fails(
+        self,
+        mock_install,
+        mock_image,
+        mock_storageclasses,
+        mock_get_subnet,
+        mock_log,
+        mock_get_executor,
+    ):
+        mock_image.side_effect = exception.MagnumException("image")
+        mock_get_subnet.side_effect = exception.MagnumException("subnet")
+        # With a single worker the lookups run in order, so waiting for
+        # one more task means every lookup has finished before the
+        # results are read
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        mock_get_executor.return_value = executor
+        mock_storageclasses.side_effect = lambda *args: executor.submit(
+            lambda: None
+        ).result()
+
+        self.assertRaisesRegex(
+            exception.MagnumException,
+            "image",
+            self.driver._update_helm_release,
+            self.context,
+            self.cluster_obj,
+        )
+
+        mock_install.assert_not_called()
+        # The other failure is logged rather than silently dropped, and
+        # the one raised is not logged again
+        logged = [call.args[-1] for call in mock_log.warning.call_args_list]
+        self.assertEqual([mock_get_subnet.side_effect], logged)
+
+    @mock.patch.object(driver.Driver, "_get_allowed_cidrs")
+    @mock.patch.object(
+        driver.Driver, "_get_k8s_keystone_auth_enabled", return_value=False
+    )
+    @mock.patch.object(
+        driver.Driver,
+        "_storageclass_definitions",
+        return_value=mock.ANY,
+    )
+    @mock.patch.object(driver.Driver, "_get_image_details", autospec=True)
+    @mock.patch.object(helm.Client, "install_or_upgrade", autospec=True)
+    def test_update_helm_release_uses_given_nodegroups(
+        self,
+        mock_install,
+        mock_image,
+        mock_storageclasses,
+        mock_get_keystone_auth_enabled,
+        mock_get_allowed_cidrs,
+    ):
+        mock_image.return_value = ("imageid1", "1.27.4", "ubuntu")
+
+        self.driver._update_helm_release(
+            self.context,
+            self.cluster_obj,
+            [self.cluster_obj.default_ng_master],
+        )
+
+        helm_install_values = mock_install.call_args[0][3]
+        # Only the master nodegroup was given, so no worker node groups
+        self.assertEqual([], helm_install_values["nodeGroups"])
+
     @mock.patch.object(driver.Driver, "_get_allowed_cidrs")
     @mock.patch.object(
         driver.Driver, "_get_k8s_keystone_auth_enabled", return_value=False
@@ -1973,12 +2282,34 @@ class ClusterAPIDriverTest(base.DbTestCase):
                     },
                     "magnum-fakeproject",
                 ),
-            ]
+            ],
+            any_order=True,
         )
+        self.assertEqual(2, mock_client.apply_secret.call_count)
         mock_string_data.assert_called_once_with(
             self.context, self.cluster_obj
         )
-        mock_labels.assert_called_with(self.cluster_obj)
+        mock_labels.assert_called_once_with(self.cluster_obj)
+
+    @mock.patch.object(ca_certificates, "get_certificate_string_data")
+    @mock.patch.object(driver.Driver, "_k8s_resource_labels")
+    @mock.patch.object(kubernetes.Client, "load")
+    def test_ensure_certificate_secrets_error(
+        self, mock_load, mock_labels, mock_string_data
+    ):
+        mock_client = mock.MagicMock(spec=kubernetes.Client)
+        mock_load.return_value = mock_client
+        mock_client.apply_secret.side_effect = exception.MagnumException
+        mock_string_data.return_value = {
+            "ca": {"tls.crt": "cert1", "tls.key": "key1"},
+        }
+
+        self.assertRaises(
+            exception.MagnumException,
+            self.driver._ensure_certificate_secrets,
+            self.context,
+            self.cluster_obj,
+        )
 
     @mock.patch("magnum.common.clients.OpenStackClients.cinder")
     def test_get_storage_classes(self, mock_cinder):
@@ -2041,6 +2372,26 @@ class ClusterAPIDriverTest(base.DbTestCase):
             self.context,
             self.cluster_obj,
         )
+        self.assertNotIn(self.context.project_id, driver._VOLUME_TYPE_CACHE)
+
+    @mock.patch("magnum.common.clients.OpenStackClients.cinder")
+    def test_get_storage_classes_volume_types_cached(self, mock_cinder):
+        CONF.capi_helm.csi_cinder_default_volume_type = "type1"
+        mock_vol_type_1 = mock.MagicMock()
+        mock_vol_type_1.name = "type1"
+        mock_cinder.return_value.volume_types.list.return_value = [
+            mock_vol_type_1
+        ]
+
+        self.driver._storageclass_definitions(self.context, self.cluster_obj)
+        storage_classes = self.driver._storageclass_definitions(
+            self.context, self.cluster_obj
+        )
+
+        self.assertEqual(
+            "type1", storage_classes["defaultStorageClass"]["volumeType"]
+        )
+        mock_cinder.return_value.volume_types.list.assert_called_once_with()
 
     @mock.patch("magnum.common.clients.OpenStackClients.cinder")
     def test_get_storage_class_volume_type_not_defined(self, mock_cinder):
@@ -2075,6 +2426,25 @@ class ClusterAPIDriverTest(base.DbTestCase):
         mock_uninstall.assert_called_once_with(
             "cluster-example-a-111111111111", namespace="magnum-fakeproject"
         )
+        for ng in self.cluster_obj.nodegroups:
+            self.assertEqual(
+                fields.ClusterStatus.DELETE_IN_PROGRESS, ng.status
+            )
+
+    @mock.patch.object(helm.Client, "uninstall_release")
+    def test_delete_cluster_skips_marked_nodegroups(self, mock_uninstall):
+        marked = self.cluster_obj.nodegroups[0]
+        marked.status = fields.ClusterStatus.DELETE_IN_PROGRESS
+        marked.save()
+
+        with mock.patch.object(
+            objects.NodeGroup, "save", autospec=True
+        ) as mock_save:
+            self.driver.delete_cluster(self.context, self.cluster_obj)
+
+        saved = [call.args[0].uuid for call in mock_save.call_args_list]
+        self.assertNotIn(marked.uuid, saved)
+        self.assertEqual(len(self.cluster_obj.nodegroups) - 1, len(saved))
 
     def test_update_cluster(self):
         self.assertRaises(
@@ -2126,9 +2496,70 @@ class ClusterAPIDriverTest(base.DbTestCase):
         )
 
         # TODO(johngarbutt) improve the testing
-        mock_update.assert_called_once_with(self.context, self.cluster_obj)
+        mock_update.assert_called_once_with(
+            self.context, self.cluster_obj, mock.ANY
+        )
+        self.assertEqual(
+            [ng.uuid for ng in self.cluster_obj.nodegroups],
+            [ng.uuid for ng in mock_update.call_args.args[2]],
+        )
         self.assertEqual("UPDATE_IN_PROGRESS", self.cluster_obj.status)
 
+    @mock.patch.object(driver.Driver, "_validate_allowed_flavor")
+    @mock.patch.object(driver.Driver, "_update_helm_release")
+    def test_upgrade_cluster_invalid_flavor(
+        self,
+        mock_update,
+        mock_validate_allowed_flavor,
+    ):
+        mock_validate_allowed_flavor.side_effect = [
+            None,
+            exception.MagnumException,
+        ]
+        statuses = [ng.status for ng in self.cluster_obj.nodegroups]
+
+        self.assertRaises(
+            exception.MagnumException,
+            self.driver.upgrade_cluster,
+            self.context,
+            self.cluster_obj,
+            mock.MagicMock(),
+            1,
+            mock.MagicMock(),
+        )
+
+        # No nodegroup is marked as updating
+        self.assertEqual(
+            statuses, [ng.status for ng in self.cluster_obj.nodegroups]
+        )
+        mock_update.assert_not_called()
+
+    @mock.patch.object(driver.Driver, "_validate_allowed_flavor")
+    @mock.patch.object(driver.Driver, "_update_helm_release")
+    def test_upgrade_cluster_skips_marked_nodegroups(
+        self,
+        mock_update,
+        mock_validate_allowed_flavor,
+    ):
+        marked = self.cluster_obj.nodegroups[0]
+        marked.status = fields.ClusterStatus.UPDATE_IN_PROGRESS
+        marked.save()
+
+        with mock.patch.object(
+            objects.NodeGroup, "save", autospec=True
+        ) as mock_save:
+            self.driver.upgrade_cluster(
+                self.context,
+                self.cluster_obj,
+                mock.Mock(uuid=self.cluster_obj.cluster_template_id),
+                1,
+                mock.MagicMock(),
+            )
+
+        saved = [call.args[0].uuid for call in mock_save.call_args_list]
+        self.assertNotIn(marked.uuid, saved)
+        self.assertEqual(len(self.cluster_obj.nodegroups) - 1, len(saved))
+
     @mock.patch.object(driver.Driver, "_validate_allowed_flavor")
     @mock.patch.object(driver.Driver, "_update_helm_release")
     def test_create_nodegroup(
@@ -2184,6 +2615,44 @@ class ClusterAPIDriverTest(base.DbTestCase):
             mock_update.call_args.args[2][0].as_dict(),
         )
 
+    @mock.patch.object(driver.Driver, "_get_allowed_cidrs")
+    @mock.patch.object(
+        driver.Driver, "_get_k8s_keystone_auth_enabled", return_value=False
+    )
+    @mock.patch.object(
+        driver.Driver,
+        "_storageclass_definitions",
+        return_value=mock.ANY,
+    )
+    @mock.patch.object(driver.Driver, "_get_image_details", autospec=True)
+    @mock.patch.object(helm.Client, "install_or_upgrade", autospec=True)
+    def test_delete_nodegroup_helm_values(
+        self,
+        mock_install,
+        mock_image,
+        mock_storageclasses,
+        mock_get_keystone_auth_enabled,
+        mock_get_allowed_cidrs,
+    ):
+        mock_image.return_value = ("imageid1", "1.27.4", "ubuntu")
+        extra_nodegroup = obj_utils.create_test_nodegroup(
+            self.context,
+            uuid=uuid4(),
+            id=123,
+            name="extra-group",
+            node_count=1,
+        )
+
+        self.driver.delete_nodegroup(
+            self.context, self.cluster_obj, extra_nodegroup
+        )
+
+        helm_install_values = mock_install.call_args[0][3]
+        self.assertEqual(
+            [self.cluster_obj.default_ng_worker.name],
+            [ng["name"] for ng in helm_install_values["nodeGroups"]],
+        )
+
     def test_create_federation(self):
         self.assertRaises(
             NotImplementedError,
@@ -2316,6 +2785,53 @@ class ClusterAPIDriverTest(base.DbTestCase):
         except Exception as e:
             self.fail("Raised exception %s" % e)
 
+    @mock.patch.object(driver_utils.time, "monotonic")
+    @mock.patch("magnum.common.clients.OpenStackClients.nova")
+    def test_validate_allowed_flavors_cached(self, mock_osc_nova, mock_time):
+        mock_flavor = mock.MagicMock(id=3, vcpus=4)
+        mock_flavor.name = "flavor_medium"
+        mock_list = mock_osc_nova.return_value.flavors.list
+        mock_list.return_value = [mock_flavor]
+        mock_time.return_value = 1000
+
+        self.driver._validate_allowed_flavor(self.context, 3)
+        self.driver._validate_allowed_flavor(self.context, "flavor_medium")
+
+        mock_list.assert_called_once_with(
+            min_ram=CONF.capi_helm.minimum_flavor_ram
+        )
+
+        mock_time.return_value = 1000 + driver._FLAVOR_CACHE_SECONDS
+        self.driver._validate_allowed_flavor(self.context, 3)
+
+        self.assertEqual(2, mock_list.call_count)
+
+    @mock.patch.object(driver_utils.time, "monotonic")
+    @mock.patch("magnum.common.clients.OpenStackClients.nova")
+    def test_validate_allowed_flavors_cache_evicts(
+        self, mock_osc_nova, mock_time
+    ):
+        mock_flavor = mock.MagicMock(id=3, vcpus=4)
+        mock_flavor.name = "flavor_medium"
+        mock_osc_nova.return_value.flavors.list.return_value = [mock_flavor]
+        mock_time.return_value = 1000
+        self.driver._validate_allowed_flavor(self.context, 3)
+
+        self.context.project_id = "other_project"
+        mock_time.return_value = 1000 + driver._FLAVOR_CACHE_SECONDS
+        self.driver._validate_allowed_flavor(self.context, 3)
+
+        # Only plain values are kept, and the expired project is dropped
+        self.assertEqual(
+            {
+                ("other_project", CONF.capi_helm.minimum_flavor_ram): (
+                    1000 + 2 * driver._FLAVOR_CACHE_SECONDS,
+                    {3: 4, "flavor_medium": 4},
+                )
+            },
+            driver._FLAVOR_CACHE,
+        )
+
     @mock.patch("novaclient.v2.flavors.FlavorManager", autospec=True)
     @mock.patch("novaclient.v2.client.Client", autospec=2)
     @mock.patch("novaclient.client.Client")
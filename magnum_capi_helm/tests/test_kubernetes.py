@@ -11,6 +11,7 @@
 #    under the License.
 
 import base64
+from concurrent import futures
 import os
 import pathlib
 import tempfile
@@ -47,6 +48,10 @@ TEST_KUBECONFIG = yaml.safe_load(TEST_KUBECONFIG_YAML)
 
 
 class TestKubernetesClient(base.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(kubernetes._CLIENTS.by_path.clear)
+
     # Basic lookup, non "-data" key
     def test_file_or_data(self):
         data, cleanup = kubernetes.ensure_file_cert(dict(key="mydata"), "key")
@@ -83,6 +88,16 @@ class TestKubernetesClient(base.TestCase):
         self.assertEqual("cafile", client.verify)
         self.assertEqual(("certfile", "keyfile"), client.cert)
 
+    def test_client_constructor_missing_context(self):
+        kubeconfig = dict(TEST_KUBECONFIG, **{"current-context": "missing"})
+
+        self.assertRaisesRegex(
+            ValueError,
+            "kubeconfig has no context named 'missing'",
+            kubernetes.Client,
+            kubeconfig,
+        )
+
     @mock.patch.object(tempfile, "NamedTemporaryFile")
     @mock.patch.object(os, "remove")
     def test_client_certificate_finalizer(self, mock_remove, mock_temp):
@@ -112,6 +127,26 @@ class TestKubernetesClient(base.TestCase):
         # Exactly one temp file should be cleaned up
         mock_remove.assert_called_once()
 
+    @mock.patch.object(tempfile, "NamedTemporaryFile")
+    @mock.patch.object(os, "remove")
+    def test_client_context_manager_removes_tempfiles(
+        self, mock_remove, mock_temp
+    ):
+        kubeconfig = yaml.safe_load(TEST_KUBECONFIG_YAML)
+        del kubeconfig["users"][0]["user"]["client-key"]
+        kubeconfig["users"][0]["user"]["client-key-data"] = base64.b64encode(
+            b"client key data"
+        ).decode("utf-8")
+
+        with kubernetes.Client(kubeconfig) as client:
+            mock_remove.assert_not_called()
+
+        mock_remove.assert_called_once_with(mock_temp().__enter__().name)
+
+        # Closing again does not try to remove the file twice
+        client.close()
+        mock_remove.assert_called_once()
+
     def test_get_kubeconfig_path_default(self):
         self.assertEqual(
             pathlib.Path.home() / ".kube" / "config",
@@ -136,19 +171,103 @@ class TestKubernetesClient(base.TestCase):
         del os.environ["KUBECONFIG"]
         self.assertEqual("bar", path)
 
+    @mock.patch.object(os, "stat")
     @mock.patch.object(kubernetes.CONF, "capi_helm")
     @mock.patch(
         "builtins.open",
         new_callable=mock.mock_open,
         read_data=TEST_KUBECONFIG_YAML,
     )
-    def test_client_load(self, mock_open, mock_conf):
+    def test_client_load(self, mock_open, mock_conf, mock_stat):
         mock_conf.kubeconfig_file = "mypath"
 
         client = kubernetes.Client.load()
 
         self.assertEqual(TEST_SERVER, client.server)
         mock_open.assert_called_once_with("mypath")
+        mock_stat.assert_called_once_with("mypath")
+
+    @mock.patch.object(os, "stat")
+    @mock.patch.object(kubernetes.CONF, "capi_helm")
+    @mock.patch(
+        "builtins.open",
+        new_callable=mock.mock_open,
+        read_data=TEST_KUBECONFIG_YAML,
+    )
+    def test_client_load_cached(self, mock_open, mock_conf, mock_stat):
+        mock_conf.kubeconfig_file = "mypath"
+        mock_stat.return_value.st_mtime_ns = 1
+
+        client = kubernetes.Client.load()
+        self.assertIs(client, kubernetes.Client.load())
+        mock_open.assert_called_once_with("mypath")
+
+        # A changed kubeconfig is loaded again, and the old client is
+        # left open for anyone still using it
+        mock_stat.return_value.st_mtime_ns = 2
+        self.assertIsNot(client, kubernetes.Client.load())
+        self.assertEqual(2, mock_open.call_count)
+        self.assertTrue(client._cleanup.alive)
+        client.close()
+
+    @mock.patch.object(os, "stat")
+    @mock.patch.object(kubernetes.CONF, "capi_helm")
+    @mock.patch(
+        "builtins.open",
+        new_callable=mock.mock_open,
+        read_data=TEST_KUBECONFIG_YAML,
+    )
+    def test_client_load_closed(self, mock_open, mock_conf, mock_stat):
+        mock_conf.kubeconfig_file = "mypath"
+        mock_stat.return_value.st_mtime_ns = 1
+
+        client = kubernetes.Client.load()
+        client.close()
+
+        self.assertIsNot(client, kubernetes.Client.load())
+        self.assertEqual(2, mock_open.call_count)
+
+    @mock.patch.object(os, "stat")
+    @mock.patch.object(kubernetes.CONF, "capi_helm")
+    @mock.patch(
+        "builtins.open",
+        new_callable=mock.mock_open,
+        read_data=TEST_KUBECONFIG_YAML,
+    )
+    def test_client_load_per_thread(self, mock_open, mock_conf, mock_stat):
+        mock_conf.kubeconfig_file = "mypath"
+        mock_stat.return_value.st_mtime_ns = 1
+        client = kubernetes.Client.load()
+        self.addCleanup(client.close)
+
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(kubernetes.Client.load).result()
+        self.addCleanup(other.close)
+
+        self.assertIsNot(client, other)
+        self.assertIs(client, kubernetes.Client.load())
+
+    @mock.patch.object(requests.Session, "request")
+    def test_request_absolute_url(self, mock_request):
+        client = kubernetes.Client(TEST_KUBECONFIG)
+
+        client.request("GET", "https://other:6443/api/v1")
+        client.request("GET", "http://other:8080/api/v1")
+
+        mock_request.assert_has_calls(
+            [
+                mock.call("GET", "https://other:6443/api/v1"),
+                mock.call("GET", "http://other:8080/api/v1"),
+            ]
+        )
+
+    @mock.patch.object(requests.Session, "request")
+    def test_request_relative_url(self, mock_request):
+        client = kubernetes.Client(TEST_KUBECONFIG)
+
+        client.request("GET", "/api/v1")
+
+        mock_request.assert_called_once_with("GET", "https://test:6443/api/v1")
 
     @mock.patch.object(requests.Session, "request")
     def test_ensure_namespace(self, mock_request):
@@ -195,6 +314,14 @@ class TestKubernetesClient(base.TestCase):
             headers={"Content-Type": "application/apply-patch+yaml"},
             params={"fieldManager": "magnum", "force": "true"},
         )
+        # The caller's data is left as it was
+        self.assertEqual(
+            dict(
+                stringData=dict(foo="bar"),
+                metadata=dict(labels=dict(baz="asdf")),
+            ),
+            test_data,
+        )
 
     @mock.patch.object(requests.Session, "request")
     def test_delete_all_secrets_by_label(self, mock_request):
@@ -462,6 +589,42 @@ class TestKubernetesClient(base.TestCase):
         )
         self.assertEqual(manifests + helm_releases, addons)
 
+    @mock.patch.object(requests.Session, "request")
+    def test_iter_addons_by_label(self, mock_request):
+        manifests = [
+            {
+                "kind": "Manifests",
+                "metadata": {"name": f"manifests{idx}", "namespace": "ns1"},
+            }
+            for idx in range(2)
+        ]
+
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "metadata": {
+                "continue": "",
+            },
+            "items": manifests,
+        }
+        mock_request.return_value = mock_response
+
+        client = kubernetes.Client(TEST_KUBECONFIG)
+        addons = client.iter_addons_by_label({"label": "cluster1"}, "ns1")
+
+        self.assertEqual(manifests[0], next(addons))
+        self.assertEqual(manifests[1], next(addons))
+        # Helm releases are only listed once the manifests are used up
+        mock_request.assert_called_once_with(
+            "GET",
+            (
+                "https://test:6443/apis/addons.stackhpc.com/"
+                "v1alpha1/namespaces/ns1/manifests"
+            ),
+            params={"labelSelector": "label=cluster1"},
+            allow_redirects=True,
+        )
+
     @mock.patch.object(requests.Session, "request")
     def test_get_all_machines_by_label(self, mock_request):
         items = [
@@ -501,3 +664,84 @@ class TestKubernetesClient(base.TestCase):
             allow_redirects=True,
         )
         self.assertEqual(items, machines)
+
+    @mock.patch.object(requests.Session, "request")
+    def test_get_all_machines_by_label_limit(self, mock_request):
+        items = [{"kind": "Machine", "metadata": {"name": "machine0"}}]
+
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "metadata": {
+                "continue": "more",
+            },
+            "items": items,
+        }
+        mock_request.return_value = mock_response
+
+        client = kubernetes.Client(TEST_KUBECONFIG)
+        machines = client.get_all_machines_by_label(
+            "capi.stackhpc.com/cluster=cluster_name",
+            "ns1",
+            limit=1,
+            metadata_only=True,
+        )
+
+        # The next page is not fetched once we have enough machines
+        mock_request.assert_called_once_with(
+            "GET",
+            (
+                "https://test:6443/apis/cluster.x-k8s.io/"
+                "v1beta1/namespaces/ns1/machines"
+            ),
+            params={
+                "labelSelector": "capi.stackhpc.com/cluster=cluster_name",
+                "limit": 1,
+            },
+            headers={
+                "Accept": (
+                    "application/json;as=PartialObjectMetadataList;"
+                    "g=meta.k8s.io;v=v1,application/json"
+                )
+            },
+            allow_redirects=True,
+        )
+        self.assertEqual(items, machines)
+
+    @mock.patch.object(requests.Session, "request")
+    def test_get_machine_deployments_by_label(self, mock_request):
+        items = [
+            {
+                "kind": "MachineDeployment",
+                "metadata": {"name": f"md{idx}", "namespace": "ns1"},
+            }
+            for idx in range(3)
+        ]
+
+        mock_response = mock.Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "metadata": {
+                "continue": "",
+            },
+            "items": items,
+        }
+        mock_request.return_value = mock_response
+
+        client = kubernetes.Client(TEST_KUBECONFIG)
+        mds = client.get_machine_deployments_by_label(
+            {"cluster.x-k8s.io/cluster-name": "cluster_name"}, "ns1"
+        )
+
+        mock_request.assert_called_once_with(
+            "GET",
+            (
+                "https://test:6443/apis/cluster.x-k8s.io/"
+                "v1beta1/namespaces/ns1/machinedeployments"
+            ),
+            params={
+                "labelSelector": "cluster.x-k8s.io/cluster-name=cluster_name"
+            },
+            allow_redirects=True,
+        )
+        self.assertEqual(items, mds)